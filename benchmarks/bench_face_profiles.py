@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 顔検出の設定(fast/balanced/accurate)ごとの検出時間と再現率の比較
+#
+#   python3 benchmarks/bench_face_profiles.py 録画1.mp4 [録画2.mp4 ...] [--target-width 80]
+#
+# 各フレームを480x360に縮小してグレイスケール+ヒストグラム平坦化し，すべての設定で顔検出する．
+# 正解データの代わりに，--referenceの設定(既定はaccurate)で見つかった顔を正解として，
+# 各設定がそれをどれだけ見つけられたか(再現率)と，正解に無い検出の数を数える
+
+import argparse
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # リポジトリ直下をimport先に加える
+
+import cv2
+import numpy as np
+
+from tello_pipeline import DETECTION_PROFILES, FaceDetector
+
+CASC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'step07_face', 'haarcascade_frontalface_alt.xml')
+
+
+# 動画を読み込んで，顔検出に渡すグレイスケール画像のリストにする
+def load_gray_frames(paths, max_frames):
+    frames = []
+    for path in paths:
+        capture = cv2.VideoCapture(path)
+        while len(frames) < max_frames:
+            ok, image = capture.read()
+            if not ok:
+                break
+            gray = cv2.cvtColor(cv2.resize(image, (480, 360)), cv2.COLOR_BGR2GRAY)
+            frames.append(cv2.equalizeHist(gray))
+    return frames
+
+
+# 2つのボックスの重なり(IoU)
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+# 正解の顔のうち見つけられた数と，正解に無い検出の数
+def match(faces, reference, threshold):
+    found = sum(1 for r in reference if any(iou(r, f) >= threshold for f in faces))
+    extra = sum(1 for f in faces if not any(iou(r, f) >= threshold for r in reference))
+    return found, extra
+
+
+def main():
+    parser = argparse.ArgumentParser(description='face detection profile benchmark')
+    parser.add_argument('videos', nargs='+')
+    parser.add_argument('--target-width', type=int, default=80)
+    parser.add_argument('--reference', default='accurate', choices=sorted(DETECTION_PROFILES))
+    parser.add_argument('--iou', type=float, default=0.3)
+    parser.add_argument('--max-frames', type=int, default=1000)
+    args = parser.parse_args()
+
+    frames = load_gray_frames(args.videos, args.max_frames)
+    if not frames:
+        sys.exit('no frames could be read from %s' % ', '.join(args.videos))
+
+    # 各設定で全フレームを検出して時間を測る
+    results = {}
+    for name in DETECTION_PROFILES:
+        detector = FaceDetector(CASC_PATH, name, args.target_width)
+        times, detections = [], []
+        for gray in frames:
+            start = time.perf_counter()
+            faces = detector.detect(gray)
+            times.append(time.perf_counter() - start)
+            detections.append([tuple(face) for face in faces])
+        results[name] = (np.array(times) * 1000.0, detections)
+
+    reference = results[args.reference][1]
+    total = sum(len(r) for r in reference)
+    print('%d frames, %d reference faces (%s)' % (len(frames), total, args.reference))
+    print('%-10s %8s %8s %8s %8s' % ('profile', 'mean ms', 'p95 ms', 'recall', 'extra'))
+    for name, (times, detections) in results.items():
+        found = extra = 0
+        for faces, ref in zip(detections, reference):
+            f, e = match(faces, ref, args.iou)
+            found += f
+            extra += e
+        recall = found / float(total) if total else float('nan')
+        print('%-10s %8.2f %8.2f %8.3f %8d' % (name, times.mean(), np.percentile(times, 95), recall, extra))
+
+
+if __name__ == "__main__":
+    main()
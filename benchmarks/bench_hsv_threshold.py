@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# HSVの範囲指定2値化の速度比較
+#   cvtColor+inRange / 32x32x32の表 / 256^3の表
+#
+#   python3 benchmarks/bench_hsv_threshold.py [動画ファイル] [--lower H S V] [--upper H S V]
+#
+# 動画を省略するとランダムな画像で測る．H_min > H_max なら0/179をまたぐ範囲になる
+
+import argparse
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # リポジトリ直下をimport先に加える
+
+import cv2
+import numpy as np
+
+from tello_pipeline import in_hsv_range, build_hsv_lut, LutClassifier
+
+
+# 測定に使うフレームを読み込む(480x360に縮小済み)
+def load_frames(path, count):
+    if path is None:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 256, (360, 480, 3), dtype=np.uint8) for _ in range(count)]
+    frames = []
+    capture = cv2.VideoCapture(path)
+    while len(frames) < count:
+        ok, image = capture.read()
+        if not ok:
+            break
+        frames.append(cv2.resize(image, (480, 360)))
+    return frames
+
+
+# fnを全フレームにrepeat周かけて，1フレームあたりの時間[ms]を返す
+def measure(fn, frames, repeat):
+    for image in frames[:5]:    # ウォームアップ
+        fn(image)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for image in frames:
+            fn(image)
+    return 1000.0 * (time.perf_counter() - start) / (repeat * len(frames))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='cvtColor+inRange vs LUT thresholding')
+    parser.add_argument('video', nargs='?', default=None)
+    parser.add_argument('--lower', type=int, nargs=3, default=(170, 80, 80))
+    parser.add_argument('--upper', type=int, nargs=3, default=(10, 255, 255))
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.frames)
+    lower = np.array(args.lower, dtype=np.uint8)
+    upper = np.array(args.upper, dtype=np.uint8)
+    shape = frames[0].shape
+    hsv = np.empty(shape, dtype=np.uint8)
+    mask = np.empty(shape[:2], dtype=np.uint8)
+
+    # cvtColor+inRange(基準)
+    def inrange(image):
+        cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=hsv)
+        return in_hsv_range(hsv, lower, upper, dst=mask)
+
+    print('%d frames %dx%d, H/S/V %s..%s' % (len(frames), shape[1], shape[0], tuple(args.lower), tuple(args.upper)))
+    print('%-16s %8.3f ms/frame' % ('cvtColor+inRange', measure(inrange, frames, args.repeat)))
+    references = [inrange(image).copy() for image in frames]
+
+    for bits in (5, 8):
+        start = time.perf_counter()
+        lut = build_hsv_lut([(lower, upper)], bits)
+        build = 1000.0 * (time.perf_counter() - start)
+        classifier = LutClassifier(bits)
+        lut_mask = np.empty(shape[:2], dtype=np.uint8)
+        elapsed = measure(lambda image: classifier.apply(image, lut, lut_mask), frames, args.repeat)
+        mismatch = np.mean([np.mean(classifier.apply(image, lut, lut_mask) != ref) for image, ref in zip(frames, references)])
+        print('%-16s %8.3f ms/frame  (build %.1f ms, mismatch %.4f%%)' % ('LUT %d bit' % bits, elapsed, build, 100.0 * mismatch))
+
+
+if __name__ == "__main__":
+    main()
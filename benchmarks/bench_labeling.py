@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ラベリング結果の描画の速度比較
+#   全ラベルをPythonのループで描く(以前のstep04) / NumPyで選んでtop_k個をまとめて描く(LabelingStage)
+#
+#   python3 benchmarks/bench_labeling.py [--density 0.01 0.05 0.2] [--top-k 100] [--min-area 1]
+#
+# ノイズの割合densityを変えたランダムな2値画像で，ラベルの数が増えた時の1フレームあたりの時間を測る
+
+import argparse
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # リポジトリ直下をimport先に加える
+
+import cv2
+import numpy as np
+
+from tello_pipeline import LabelingStage
+from tello_pipeline.stages import draw_label, draw_labels
+
+
+# 以前のstep04と同じく，全ラベルを1個ずつ描く
+def draw_all(image, stats, center):
+    for index in range(len(stats)):
+        x, y, w, h, s = stats[index]
+        mx = int(center[index][0])
+        my = int(center[index][1])
+        draw_label(image, x, y, w, h, s, mx, my)
+
+
+# fnを全フレームにrepeat周かけて，1フレームあたりの時間[ms]を返す
+def measure(fn, masks, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for mask in masks:
+            fn(mask)
+    return 1000.0 * (time.perf_counter() - start) / (repeat * len(masks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='per-label loop vs vectorized label selection and drawing')
+    parser.add_argument('--density', type=float, nargs='+', default=(0.01, 0.05, 0.2))
+    parser.add_argument('--top-k', type=int, default=100)
+    parser.add_argument('--min-area', type=int, default=1)
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    image = np.zeros((360, 480, 3), dtype=np.uint8)
+    stage = LabelingStage(min_area=args.min_area, top_k=args.top_k)
+
+    def loop(mask):
+        _, _, stats, center = cv2.connectedComponentsWithStats(mask)
+        draw_all(image, stats[1:], center[1:])
+
+    def vectorized(mask):
+        _, _, stats, center = cv2.connectedComponentsWithStats(mask)
+        draw_labels(image, *stage.select(stats[1:], center[1:]))
+
+    def labeling_only(mask):
+        cv2.connectedComponentsWithStats(mask)
+
+    print('%-8s %8s %12s %12s %12s' % ('density', 'labels', 'labeling', 'loop', 'vectorized'))
+    for density in args.density:
+        masks = [np.where(rng.random((360, 480)) < density, 255, 0).astype(np.uint8) for _ in range(args.frames)]
+        labels = np.mean([cv2.connectedComponentsWithStats(mask)[0] - 1 for mask in masks])
+        print('%-8.3f %8d %9.3f ms %9.3f ms %9.3f ms' % (density, labels, measure(labeling_only, masks, args.repeat),
+                                                       measure(loop, masks, args.repeat),
+                                                       measure(vectorized, masks, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
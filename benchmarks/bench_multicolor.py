@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 複数の色の面積最大のラベルを求める速度比較
+#   色ごとにcvtColor+inRange+ラベリング / 表で1回で分類して1回のラベリング(MultiColorStage)
+#
+#   python3 benchmarks/bench_multicolor.py [動画ファイル] [--colors 4]
+#
+# 動画を省略するとランダムな画像で測る．色はHueを等間隔に分けたcolors個の範囲
+
+import argparse
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # リポジトリ直下をimport先に加える
+
+import cv2
+import numpy as np
+
+from tello_pipeline import in_hsv_range, build_hsv_lut, LutClassifier, ClassBlobFinder
+from bench_hsv_threshold import load_frames, measure
+
+
+# Hueをcount等分した範囲(S,Vは80以上)
+def hue_ranges(count):
+    step = 180 // count
+    return [(np.array((i * step, 80, 80), dtype=np.uint8), np.array((i * step + step - 1, 255, 255), dtype=np.uint8))
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='per-color inRange+labeling vs single-pass class-id labeling')
+    parser.add_argument('video', nargs='?', default=None)
+    parser.add_argument('--colors', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.frames)
+    shape = frames[0].shape
+    hsv = np.empty(shape, dtype=np.uint8)
+    mask = np.empty(shape[:2], dtype=np.uint8)
+    classes = np.empty(shape[:2], dtype=np.uint8)
+    classifier = LutClassifier(5)
+
+    print('%d frames %dx%d' % (len(frames), shape[1], shape[0]))
+    print('%-7s %14s %14s' % ('colors', 'per color', 'single pass'))
+    for count in range(1, args.colors + 1):
+        ranges = hue_ranges(count)
+        lut = build_hsv_lut(ranges, 5, values=range(1, count + 1))
+        finder = ClassBlobFinder(count)
+
+        # 色ごとにHSV変換・2値化・ラベリングして面積最大を探す(以前のやり方を色の数だけ)
+        def per_color(image):
+            for lower, upper in ranges:
+                cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=hsv)
+                in_hsv_range(hsv, lower, upper, dst=mask)
+                num_labels, _, stats, center = cv2.connectedComponentsWithStats(mask)
+                if num_labels > 1:
+                    np.argmax(stats[1:, cv2.CC_STAT_AREA])
+
+        def single_pass(image):
+            classifier.apply(image, lut, classes)
+            finder.find(classes)
+
+        print('%-7d %11.3f ms %11.3f ms' % (count, measure(per_color, frames, args.repeat),
+                                            measure(single_pass, frames, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 色追跡の速度と追跡の成功率の比較
+#   2値化+ラベリング(毎フレーム画面全体) / 2値化+ROIだけのラベリング(ColorTrackingStage) /
+#   逆投影+CamShift(CamShiftTrackingStage)
+#
+#   python3 benchmarks/bench_tracking.py [--frames 300] [--dim 0.4]
+#
+# 灰色っぽいノイズの背景の上を赤い円が動く合成映像を使う．途中で画面全体の明るさを
+# dim倍まで下げていくので，2値化の上下限を決め打ちした追跡がどこまで付いてこられるかも分かる
+
+import argparse
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # リポジトリ直下をimport先に加える
+
+import cv2
+import numpy as np
+
+from tello_pipeline import TelloPipeline, HsvThresholdStage, LabelingStage, ColorTrackingStage, CamShiftTrackingStage
+from tello_pipeline.io_backend import HeadlessBackend
+
+
+# 合成映像(960x720)と，各フレームの円の中心(480x360に縮小した座標)を作る
+def make_frames(count, dim):
+    rng = np.random.default_rng(0)
+    background = rng.integers(60, 120, (720, 960, 1), dtype=np.uint8).repeat(3, axis=2)
+    background = cv2.GaussianBlur(background, (5, 5), 0)
+    frames, centers = [], []
+    for i in range(count):
+        t = i / count
+        cx = int(480 + 320 * np.sin(2 * np.pi * 2 * t))
+        cy = int(360 + 160 * np.sin(2 * np.pi * 3 * t))
+        image = background.copy()
+        cv2.circle(image, (cx, cy), 50, (30, 30, 220), -1)
+        scale = 1.0 - (1.0 - dim) * min(max(2 * t - 0.5, 0.0), 1.0)     # 後半で暗くしていく
+        frames.append(cv2.convertScaleAbs(image, alpha=scale))
+        centers.append((cx / 2, cy / 2))
+    return frames, centers
+
+
+# 赤の範囲で2値化するステージにしておく
+def red_threshold(stage):
+    stage.params.lower[:] = (170, 120, 120)
+    stage.params.upper[:] = (10, 255, 255)
+    return stage
+
+
+# stagesを全フレームにかけて，1フレームあたりの時間[ms]，見失ったフレーム数，中心の誤差の平均[px]を返す
+def run(stages, frames, centers):
+    pipeline = TelloPipeline(stages, backend=HeadlessBackend(keys=None))
+    lost, errors = 0, []
+    start = time.perf_counter()
+    for seq, (image, (cx, cy)) in enumerate(zip(frames, centers)):
+        ctx = pipeline.process_frame(image, seq, seq / 30.0)
+        if ctx.target is None:
+            lost += 1
+            continue
+        x, y, w, h = ctx.target
+        errors.append(np.hypot(x + w / 2 - cx, y + h / 2 - cy))
+    elapsed = 1000.0 * (time.perf_counter() - start) / len(frames)
+    return elapsed, lost, np.mean(errors) if errors else float('nan')
+
+
+# 毎フレーム画面全体をラベリングして面積最大を選ぶ(ROIを使わない)
+class FullLabelingStage(LabelingStage):
+    def process(self, ctx, pipeline):
+        super().process(ctx, pipeline)
+        stats, _ = ctx.labels
+        if len(stats) > 0:
+            ctx.target = tuple(int(v) for v in stats[0][:4])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='threshold+labeling vs back projection+CamShift tracking')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--dim', type=float, default=0.4)
+    args = parser.parse_args()
+
+    frames, centers = make_frames(args.frames, args.dim)
+    modes = (
+        ('labeling', lambda: [red_threshold(HsvThresholdStage()), FullLabelingStage(top_k=1)]),
+        ('labeling+ROI', lambda: [red_threshold(HsvThresholdStage()), ColorTrackingStage()]),
+        ('camshift', lambda: [red_threshold(CamShiftTrackingStage())]),
+    )
+    print('%d frames 960x720 -> 480x360, brightness 1.0 -> %.1f' % (args.frames, args.dim))
+    print('%-14s %12s %8s %10s' % ('mode', 'time', 'lost', 'error'))
+    for name, make in modes:
+        stages = make()
+        elapsed, lost, error = run(stages, frames, centers)
+        print('%-14s %9.3f ms %8d %7.1f px' % (name, elapsed, lost, error))
+        if isinstance(stages[0], CamShiftTrackingStage):
+            stages[0].teardown(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,157 +1,29 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from djitellopy import Tello    # DJITelloPyのTelloクラスをインポート
-import time                     # time.sleepを使いたいので
-import cv2                      # OpenCVを使うため
+import os                       # 共通モジュールのパスを作るため
+import sys                      # 共通モジュールのパスを通すため
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # リポジトリ直下をimport先に加える
+
+from tello_pipeline import TelloPipeline, HsvThresholdStage, HsvLutThresholdStage   # 共通のフレーム処理パイプライン
 
 # メイン関数
 def main():
     # 初期化部
-    # Telloクラスを使って，tellというインスタンス(実体)を作る
-    tello = Tello(retry_count=1)    # 応答が来ないときのリトライ回数は1(デフォルトは3)
-    tello.RESPONSE_TIMEOUT = 0.01   # コマンド応答のタイムアウトは短くした(デフォルトは7)
-
-    # Telloへ接続
-    tello.connect()
-
-    # 画像転送を有効にする
-    tello.streamoff()   # 誤動作防止の為、最初にOFFする
-    tello.streamon()    # 画像転送をONに
-    frame_read = tello.get_frame_read()     # 画像フレームを取得するBackgroundFrameReadクラスのインスタンスを作る
-
-    current_time = time.time()  # 現在時刻の保存変数
-    pre_time = current_time     # 5秒ごとの'command'送信のための時刻変数
-
-    # SDKバージョンを問い合わせ
-    sdk_ver = tello.query_sdk_version()
-
-    # モータとカメラの切替フラグ
-    motor_on = False                    # モータON/OFFのフラグ
-    camera_dir = Tello.CAMERA_FORWARD   # 前方/下方カメラの方向のフラグ
-
-    # 前回強制終了して下方カメラかもしれないので
-    if sdk_ver == '30':                                     # SDK 3.0に対応しているか？ 
-        tello.set_video_direction(Tello.CAMERA_FORWARD)     # カメラは前方に
-
-    # トラックバーを作るため，まず最初にウィンドウを生成
-    cv2.namedWindow("OpenCV Window")
-
-    # トラックバーのコールバック関数は何もしない空の関数
-    def nothing(x):
-        pass        # passは何もしないという命令
-
-    # トラックバーの生成
-    cv2.createTrackbar("H_min", "OpenCV Window", 0, 179, nothing)       # Hueの最大値は179
-    cv2.createTrackbar("H_max", "OpenCV Window", 179, 179, nothing)
-    cv2.createTrackbar("S_min", "OpenCV Window", 0, 255, nothing)
-    cv2.createTrackbar("S_max", "OpenCV Window", 255, 255, nothing)
-    cv2.createTrackbar("V_min", "OpenCV Window", 0, 255, nothing)
-    cv2.createTrackbar("V_max", "OpenCV Window", 255, 255, nothing)
-
-    time.sleep(0.5)     # 通信が安定するまでちょっと待つ
-
-    # ループ部
-    # Ctrl+cが押されるまでループ
-    try:
-        # 永久ループで繰り返す
-        while True:
-
-            # (A) 画像取得
-            image = frame_read.frame    # 映像を1フレーム取得しimage変数に格納
-
-            # (B) 画像サイズ変更と、カメラ方向による回転
-            small_image = cv2.resize(image, dsize=(480,360) )   # 画像サイズを半分に変更
-
-            if camera_dir == Tello.CAMERA_DOWNWARD:     # 下向きカメラは画像の向きが90度ずれている
-                small_image = cv2.rotate(small_image, cv2.ROTATE_90_CLOCKWISE)      # 90度回転して、画像の上を前方にする
-
-            # (C) ここから画像処理
-            bgr_image = small_image
-            hsv_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV)  # BGR画像 -> HSV画像
-
-            # トラックバーの値を取る
-            h_min = cv2.getTrackbarPos("H_min", "OpenCV Window")
-            h_max = cv2.getTrackbarPos("H_max", "OpenCV Window")
-            s_min = cv2.getTrackbarPos("S_min", "OpenCV Window")
-            s_max = cv2.getTrackbarPos("S_max", "OpenCV Window")
-            v_min = cv2.getTrackbarPos("V_min", "OpenCV Window")
-            v_max = cv2.getTrackbarPos("V_max", "OpenCV Window")
-
-            # inRange関数で範囲指定２値化
-            bin_image = cv2.inRange(hsv_image, (h_min, s_min, v_min), (h_max, s_max, v_max)) # HSV画像なのでタプルもHSV並び
-
-            # bitwise_andで元画像にマスクをかける -> マスクされた部分の色だけ残る
-            result_image = cv2.bitwise_and(hsv_image, hsv_image, mask=bin_image)   # HSV画像 AND HSV画像 なので，自分自身とのANDは何も変化しない->マスクだけ効かせる
-
-            # (X) ウィンドウに表示
-            cv2.imshow('OpenCV Window', result_image)    # ウィンドウに表示するイメージを変えれば色々表示できる
-            cv2.imshow('Binary Image', bin_image) 
-
-            # (Y) OpenCVウィンドウでキー入力を1ms待つ
-            key = cv2.waitKey(1) & 0xFF
-            if key == 27:                   # key が27(ESC)だったらwhileループを脱出，プログラム終了
-                break
-            elif key == ord('t'):           # 離陸
-                tello.takeoff()
-            elif key == ord('l'):           # 着陸
-                tello.land()
-            elif key == ord('w'):           # 前進 30cm
-                tello.move_forward(30)
-            elif key == ord('s'):           # 後進 30cm
-                tello.move_back(30)
-            elif key == ord('a'):           # 左移動 30cm
-                tello.move_left(30)
-            elif key == ord('d'):           # 右移動 30cm
-                tello.move_right(30)
-            elif key == ord('e'):           # 旋回-時計回り 30度
-                tello.rotate_clockwise(30)
-            elif key == ord('q'):           # 旋回-反時計回り 30度
-                tello.rotate_counter_clockwise(30)
-            elif key == ord('r'):           # 上昇 30cm
-                tello.move_up(30)
-            elif key == ord('f'):           # 下降 30cm
-                tello.move_down(30)
-            elif key == ord('p'):           # ステータスをprintする
-                print(tello.get_current_state())
-            elif key == ord('m'):           # モータ始動/停止を切り替え
-                if sdk_ver == '30':         # SDK 3.0に対応しているか？
-                    if motor_on == False:       # 停止中なら始動 
-                        tello.turn_motor_on()
-                        motor_on = True
-                    else:                       # 回転中なら停止
-                        tello.turn_motor_off()
-                        motor_on = False
-            elif key == ord('c'):           # カメラの前方/下方の切り替え
-                if sdk_ver == '30':         # SDK 3.0に対応しているか？
-                    if camera_dir == Tello.CAMERA_FORWARD:     # 前方なら下方へ変更
-                        tello.set_video_direction(Tello.CAMERA_DOWNWARD)
-                        camera_dir = Tello.CAMERA_DOWNWARD     # フラグ変更
-                    else:                                      # 下方なら前方へ変更
-                        tello.set_video_direction(Tello.CAMERA_FORWARD)
-                        camera_dir = Tello.CAMERA_FORWARD      # フラグ変更
-                    time.sleep(0.5)     # 映像が切り替わるまで少し待つ
-
-            # (Z) 10秒おきに'command'を送って、死活チェックを通す
-            current_time = time.time()                          # 現在時刻を取得
-            if current_time - pre_time > 10.0 :                 # 前回時刻から10秒以上経過しているか？
-                tello.send_command_without_return('command')    # 'command'送信
-                pre_time = current_time                         # 前回時刻を更新
-
-    except( KeyboardInterrupt, SystemExit):    # Ctrl+cが押されたらループ脱出
-        print( "Ctrl+c を検知" )
-
-    # 終了処理部
-    cv2.destroyAllWindows()                             # すべてのOpenCVウィンドウを消去
-    
-    if sdk_ver == '30':                                 # SDK 3.0に対応しているか？
-        tello.set_video_direction(Tello.CAMERA_FORWARD) # カメラは前方に戻しておく
-
-    tello.streamoff()                                   # 画像転送を終了(熱暴走防止)
-    frame_read.stop()                                   # 画像受信スレッドを止める
-
-    del tello.background_frame_read                     # フレーム受信のインスタンスを削除    
-    del tello                                           # telloインスタンスを削除
+    # パイプラインを作り，このstepの画像処理ステージを登録する
+    pipeline = TelloPipeline()
+    # 環境変数TELLO_THRESHOLD=lut[:bits]なら，HSV変換をせずに表を引いて2値化する(bitsは省略すると5，8なら完全な表)
+    engine, _, bits = os.environ.get('TELLO_THRESHOLD', '').partition(':')
+    if engine == 'lut':
+        pipeline.add_stage(HsvLutThresholdStage(bits=int(bits) if bits else 5))     # 表引きによるHSVの範囲指定2値化
+    elif engine in ('', 'inrange'):
+        pipeline.add_stage(HsvThresholdStage())     # HSVの範囲指定2値化
+    else:
+        raise ValueError('unknown TELLO_THRESHOLD: %s' % engine)
+
+    # 接続 -> ループ(取得・リサイズ・回転・画像処理・表示・キー入力) -> 終了処理 を実行
+    # Ctrl+cかESCキーが押されるまでループする
+    pipeline.run()
 
 
 # "python3 main_hsv.py"として実行された時だけ動く様にするおまじない処理
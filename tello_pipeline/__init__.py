@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+# 各stepのmain()で共通だった「取得→リサイズ→回転→処理→表示→キー入力」のループを
+# 1か所にまとめたパッケージ．画像処理部分はステージとして差し替えられる．
+
+from .common import MAIN_WINDOW, BINARY_WINDOW, ensure_buffer
+from .pipeline import TelloPipeline, FrameContext
+from .params import ThresholdParams
+from .instrument import StageTimer
+from .recording import FlightRecorder, ReplaySource
+from .threaded import DropOldestQueue, ThreadedLoop
+from .scheduler import FrameScheduler
+from .io_backend import OpenCVBackend, ThrottledBackend, HeadlessBackend, backend_from_env
+from .lut import in_hsv_range, build_hsv_lut, LutClassifier
+from .blob import Blob, LargestBlobTracker, ClassBlobFinder
+from .face import DETECTION_PROFILES, FaceDetector, TemplateTracker, FaceDetectWorker
+from .controller import PidController
+from .camshift import CamShiftTracker
+from .stages import (Stage, BgrThresholdStage, HsvThresholdStage, HsvLutThresholdStage,
+                     LabelingStage, ColorTrackingStage, FaceTrackingStage, LineTraceStage, MultiColorStage,
+                     CamShiftTrackingStage)
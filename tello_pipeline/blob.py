@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import cv2                      # ラベリングのため
+import numpy as np              # 面積最大のラベルを探すため
+
+from .roi import RoiPredictor
+
+
+# 面積最大のラベル1つ分の情報
+class Blob:
+    __slots__ = ('x', 'y', 'w', 'h', 'area', 'cx', 'cy')
+
+    def __init__(self, x, y, w, h, area, cx, cy):
+        self.x, self.y, self.w, self.h = x, y, w, h     # バウンディングボックス
+        self.area = area                                # 面積[画素]
+        self.cx, self.cy = cx, cy                       # 重心位置
+
+    def box(self):
+        return (self.x, self.y, self.w, self.h)
+
+
+# 2値画像から面積最大のラベルを探すクラス
+# 予測した位置の周り(ROI)だけをラベリングし，見失うたびにROIを広げて，
+# 見失い続けた時だけ画面全体を探す．scale>1なら2値画像を縮小してからラベリングする
+class LargestBlobTracker:
+    def __init__(self, scale=1, min_area=1, min_ratio=0.25, predictor=None):
+        self.scale = scale          # 2値画像の縮小率(1なら縮小しない)
+        self.min_area = min_area    # これより小さいラベルは見失ったとみなす
+        self.min_ratio = min_ratio  # ROIの中で前回の面積のこの割合より小さければ見失ったとみなす(ノイズに飛び移らないように)
+        self.predictor = predictor if predictor is not None else RoiPredictor()     # 次の位置とROIの予測
+        self.last = None            # 前回見つけたBlob
+        self.locked_area = 0        # 画面全体から見つけた時の面積(ROIで見つけたラベルと比べる)
+        self.small = None           # 縮小した2値画像の出力バッファ
+
+        # 統計用のカウンタ
+        self.roi_searches = 0       # ROIだけを探した回数
+        self.full_searches = 0      # 画面全体を探した回数
+        self.deferred_searches = 0  # 画面全体を探すのを後回しにした回数
+
+    # 見失った状態に戻す(次回は画面全体を探す)
+    def reset(self):
+        self.last = None
+        self.predictor.reset()
+
+    # maskの中で面積最大のラベルを探す．(ox,oy)はmaskの左上の元画像での位置
+    # nearにBlobを渡すと，面積最大ではなくnearのボックスの中の画素が一番多いラベルを選ぶ
+    def _search(self, mask, ox=0, oy=0, near=None):
+        scale = self.scale
+        if scale > 1:
+            h, w = mask.shape[0] // scale, mask.shape[1] // scale
+            if self.small is None or self.small.shape != (h, w):
+                self.small = np.empty((h, w), dtype=np.uint8)
+            cv2.resize(mask, (w, h), dst=self.small, interpolation=cv2.INTER_NEAREST)
+            mask = self.small
+
+        # 面積・重心計算付きのラベリング処理を行う
+        num_labels, labels, stats, center = cv2.connectedComponentsWithStats(mask)
+        if num_labels <= 1:
+            return None
+
+        if near is not None:
+            # nearのボックスの中のラベルの画素数を数えて，背景を除いて一番多いものを選ぶ
+            x0, y0 = (near.x - ox) // scale, (near.y - oy) // scale
+            x1, y1 = -(-(near.x + near.w - ox) // scale), -(-(near.y + near.h - oy) // scale)
+            count = np.bincount(labels[y0:y1, x0:x1].reshape(-1), minlength=num_labels)
+            index = 1 + int(np.argmax(count[1:]))
+        else:
+            # 先頭のラベルは背景なので，コピーせずにスライスで除いてから面積最大を探す
+            index = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        x, y, w, h, area = (int(v) for v in stats[index])
+        if area * scale * scale < self.min_area:
+            return None
+        cx, cy = center[index]
+        return Blob(ox + x * scale, oy + y * scale, w * scale, h * scale, area * scale * scale,
+                    ox + (cx + 0.5) * scale - 0.5, oy + (cy + 0.5) * scale - 0.5)
+
+    # 面積最大のラベルのBlobを返す．見つからなければNone．tはフレームの取得時刻
+    # full=Falseなら画面全体は探さない(処理が遅れている時用．ROIの端に接していてもROIの結果を使う)
+    def update(self, mask, t=None, full=True):
+        roi = self.predictor.roi(mask.shape, t)
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            self.roi_searches += 1
+            blob = self._search(mask[y0:y1, x0:x1], x0, y0)
+            if blob is None or blob.area < self.locked_area * self.min_ratio:
+                self.predictor.miss()   # 次はROIを広げて探す
+                self.last = None
+                return None
+            # ROIの端に接していたらラベルが切れているかもしれないので，画面全体をラベリングして
+            # ROIで見つけたラベルとつながっているラベルを選び直す(面積最大の別の物体には飛び移らない)
+            if full and self._touches_edge(blob, roi, mask.shape):
+                self.full_searches += 1
+                whole = self._search(mask, near=blob)
+                if whole is not None:
+                    blob = whole
+                    self.locked_area = blob.area    # 切れていない全体の面積を基準にする
+            self.predictor.hit(blob.box(), t)
+            self.last = blob
+            return blob
+
+        if not full:
+            self.deferred_searches += 1
+            self.last = None
+            return None
+
+        self.full_searches += 1
+        self.last = self._search(mask)
+        if self.last is not None:
+            self.predictor.hit(self.last.box(), t)
+            self.locked_area = self.last.area   # 画面全体で見つけた時の面積を基準にする
+        return self.last
+
+    # ボックスがROIの端(画面の端は除く)に接しているか
+    @staticmethod
+    def _touches_edge(blob, roi, shape):
+        x0, y0, x1, y1 = roi
+        return ((x0 > 0 and blob.x <= x0) or (y0 > 0 and blob.y <= y0) or
+                (x1 < shape[1] and blob.x + blob.w >= x1) or (y1 < shape[0] and blob.y + blob.h >= y1))
+
+    def stats(self):
+        return {'roi_searches': self.roi_searches, 'full_searches': self.full_searches,
+                'deferred_searches': self.deferred_searches}
+
+
+# クラス番号画像(0は背景，1..num_classesが各色)から，クラスごとの面積最大のラベルを1回のラベリングで探す
+# 違うクラスの領域が接していても別のラベルになるように，隣の画素とクラスが違う(どちらも背景でない)画素を
+# 背景にしてから4近傍でラベリングし，ラベルごとのクラスと面積で並べて各クラスの最大を取り出す
+class ClassBlobFinder:
+    def __init__(self, num_classes, min_area=1):
+        self.num_classes = num_classes
+        self.min_area = min_area    # これより小さいラベルは見つからなかったとみなす
+        self.mask = None            # ラベリングする2値画像の出力バッファ
+        self.cut_x = None           # 右隣とクラスが違う画素の出力バッファ
+        self.cut_y = None           # 下隣とクラスが違う画素の出力バッファ
+        self.label_class = None     # ラベル番号 -> クラス番号 の表
+
+    def _allocate(self, shape):
+        self.mask = np.empty(shape, dtype=np.uint8)
+        self.cut_x = np.empty((shape[0], shape[1] - 1), dtype=np.uint8)
+        self.cut_y = np.empty((shape[0] - 1, shape[1]), dtype=np.uint8)
+
+    # クラスごとの面積最大のBlobのリスト(i番目がクラスi+1．見つからなければNone)を返す
+    def find(self, classes):
+        if self.mask is None or self.mask.shape != classes.shape:
+            self._allocate(classes.shape)
+        mask = self.mask
+        cv2.compare(classes, 0, cv2.CMP_NE, dst=mask)
+
+        # 右隣・下隣と違うクラスの画素を背景にする(隣が背景ならそのまま)
+        # 隣と違う(255)かつ隣が背景でない画素を，飽和する引き算で0にする
+        cut_x, cut_y = self.cut_x, self.cut_y
+        cv2.compare(classes[:, :-1], classes[:, 1:], cv2.CMP_NE, dst=cut_x)
+        cv2.bitwise_and(cut_x, mask[:, 1:], dst=cut_x)
+        cv2.compare(classes[:-1], classes[1:], cv2.CMP_NE, dst=cut_y)
+        cv2.bitwise_and(cut_y, mask[1:], dst=cut_y)
+        cv2.subtract(mask[:, :-1], cut_x, dst=mask[:, :-1])
+        cv2.subtract(mask[:-1], cut_y, dst=mask[:-1])
+
+        num_labels, labels, stats, center = cv2.connectedComponentsWithStats(mask, connectivity=4)
+        blobs = [None] * self.num_classes
+        if num_labels <= 1:
+            return blobs
+
+        # ラベルごとのクラス番号(ラベルの中の画素はすべて同じクラス．背景のラベル0は0にしておく)
+        if self.label_class is None or len(self.label_class) < num_labels:
+            self.label_class = np.empty(2 * num_labels, dtype=np.uint8)     # 多めに確保して作り直しを減らす
+        label_class = self.label_class[:num_labels]
+        label_class[labels.reshape(-1)] = classes.reshape(-1)
+        label_class[0] = 0
+
+        # クラス順・面積順に並べて，クラスごとの最後(面積最大)のラベルを取り出す
+        area = stats[:, cv2.CC_STAT_AREA]
+        order = 1 + np.lexsort((area[1:], label_class[1:]))
+        sorted_class = label_class[order]
+        last = np.flatnonzero(np.append(sorted_class[1:] != sorted_class[:-1], True))
+        for index in order[last]:
+            x, y, w, h, s = (int(v) for v in stats[index])
+            if s >= self.min_area:
+                cx, cy = center[index]
+                blobs[label_class[index] - 1] = Blob(x, y, w, h, s, float(cx), float(cy))
+        return blobs
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# 色ヒストグラムの逆投影とCamShiftで物体を追いかけるクラス
+# 最初に対象の範囲からH-Sの2次元ヒストグラムを作っておき，毎フレームは前回の位置の周りだけを
+# HSVにして逆投影(各画素が対象の色らしい度合い)を求め，CamShiftで窓を動かす．
+# 2値化の上下限を決め打ちしないので，明るさ(V)が変わっても追いかけやすい
+
+import cv2                      # 逆投影とCamShiftのため
+import numpy as np              # ヒストグラムの確保のため
+
+
+class CamShiftTracker:
+    def __init__(self, bins=(30, 32), search=0.5, min_density=0.1, min_sat=60, min_val=32):
+        self.bins = bins                # H,Sのビン数
+        self.search = search            # 逆投影を求める範囲を窓の何倍分広げるか
+        self.min_density = min_density  # 窓の中の逆投影の平均(0-1)がこれより低ければ見失ったとみなす
+        self.min_sat = min_sat          # ヒストグラムに入れる最小の彩度(灰色っぽい画素はHueが不安定なので除く)
+        self.min_val = min_val          # ヒストグラムに入れる最小の明度
+        self.criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 1)   # CamShiftの終了条件
+        self.hist = None                # 対象のH-Sヒストグラム(0-255に正規化)
+        self.window = None              # 追跡窓(x,y,w,h)
+        self.rotated = None             # CamShiftの回転矩形((cx,cy),(w,h),角度)
+        self.roi = None                 # 最後に逆投影を求めた範囲(x0,y0,x1,y1)
+        self.hsv = None                 # 探す範囲のHSV画像の出力バッファ
+        self.back = None                # 探す範囲の逆投影の出力バッファ
+
+    def active(self):
+        return self.window is not None
+
+    def reset(self):
+        self.window = None
+        self.rotated = None
+
+    # HSV画像のbox(x,y,w,h)の範囲から対象のヒストグラムを作る．maskがあればその画素だけを使う
+    def learn(self, hsv, box, mask=None):
+        x, y, w, h = (int(v) for v in box)
+        if w < 2 or h < 2:
+            self.reset()
+            return
+        region = hsv[y:y+h, x:x+w]
+        valid = cv2.inRange(region, (0, self.min_sat, self.min_val), (180, 255, 255))
+        if mask is not None:
+            cv2.bitwise_and(valid, mask[y:y+h, x:x+w], dst=valid)
+        self.hist = cv2.calcHist([region], [0, 1], valid, list(self.bins), [0, 180, 0, 256])
+        cv2.normalize(self.hist, self.hist, 0, 255, cv2.NORM_MINMAX)
+        self.window = (x, y, w, h)
+
+    # 前回の窓の周りで対象を探す．見つかれば窓(x,y,w,h)，見失えばNoneを返す
+    def update(self, image):
+        if self.window is None:
+            return None
+        x, y, w, h = self.window
+        pad_x = max(int(w * self.search), 8)
+        pad_y = max(int(h * self.search), 8)
+        x0, y0 = max(x - pad_x, 0), max(y - pad_y, 0)
+        x1, y1 = min(x + w + pad_x, image.shape[1]), min(y + h + pad_y, image.shape[0])
+        self.roi = (x0, y0, x1, y1)
+
+        # 探す範囲だけHSVにして逆投影する(バッファは大きさが変わった時だけ確保し直す)
+        if self.hsv is None or self.hsv.shape[:2] != (y1 - y0, x1 - x0):
+            self.hsv = np.empty((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+            self.back = np.empty((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2HSV, dst=self.hsv)
+        cv2.calcBackProject([self.hsv], [0, 1], self.hist, [0, 180, 0, 256], 1, dst=self.back)
+
+        # CamShiftは探す範囲の中の座標で動かす
+        ((cx, cy), size, angle), (wx, wy, ww, wh) = cv2.CamShift(self.back, (x - x0, y - y0, w, h), self.criteria)
+        if ww < 2 or wh < 2:
+            self.reset()
+            return None
+        density = cv2.mean(self.back[wy:wy+wh, wx:wx+ww])[0] / 255.0
+        if density < self.min_density:
+            self.reset()
+            return None
+        self.window = (x0 + wx, y0 + wy, ww, wh)
+        self.rotated = ((x0 + cx, y0 + cy), size, angle)    # 元画像の座標に戻しておく
+        return self.window
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import collections              # 待ち行列にdequeを使うため
+import threading                # コマンド送信を別スレッドで行うため
+from concurrent.futures import Future   # コマンドの完了を通知するため
+import queue                    # 待ち行列が一杯の時の例外を使うため
+
+# 連続したキー入力をまとめられるコマンドと，まとめた後の引数の上限(Tello SDKの範囲)
+MERGEABLE = {
+    'move_forward': 500, 'move_back': 500, 'move_left': 500, 'move_right': 500,
+    'move_up': 500, 'move_down': 500,
+    'rotate_clockwise': 360, 'rotate_counter_clockwise': 360,
+}
+
+
+# 待ち行列に積まれた1つのコマンド
+class _Command:
+    __slots__ = ('name', 'args', 'future')
+
+    def __init__(self, name, args):
+        self.name = name        # Telloクラスのメソッド名
+        self.args = args        # 引数のタプル
+        self.future = Future()  # 完了・失敗を受け取るためのFuture
+
+
+# takeoffやmove_forwardなど応答待ちのあるコマンドを，映像ループとは別のスレッドで送るクラス
+# 映像ループはsubmitしてすぐに戻れるので，UDPの往復で映像が止まらない
+class CommandExecutor:
+    def __init__(self, tello, maxsize=8, callback=None):
+        self.tello = tello
+        self.maxsize = maxsize              # 待ち行列に積めるコマンド数の上限
+        self.callback = callback            # 各コマンドの完了時に呼ぶ関数(引数はFuture)
+        self.pending = collections.deque()  # 送信待ちのコマンド
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.merged = 0         # 連続キー入力をまとめた回数
+        self.rejected = 0       # 待ち行列が一杯で捨てた回数
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    # 送信中のコマンドが終わるのを待ってスレッドを止める．待ち行列に残ったものは取り消す
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self._cancel_pending()
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _cancel_pending(self):
+        while self.pending:
+            self.pending.popleft().future.cancel()
+
+    # コマンドを待ち行列に積んでFutureを返す
+    # clear=Trueなら送信待ちのコマンドを取り消してから積む(着陸などを最優先にしたい時)
+    def submit(self, name, *args, clear=False):
+        with self.cond:
+            if clear:
+                self._cancel_pending()
+            elif self.pending:
+                last = self.pending[-1]
+                if last.name == name:
+                    # 同じキーの連打は1つのコマンドにまとめる
+                    if name in MERGEABLE:
+                        total = last.args[0] + args[0]
+                        if total <= MERGEABLE[name]:
+                            last.args = (total,)
+                            self.merged += 1
+                            return last.future
+                    elif last.args == args:
+                        self.merged += 1
+                        return last.future
+
+            command = _Command(name, args)
+            if self.callback is not None:
+                command.future.add_done_callback(self.callback)
+            if len(self.pending) >= self.maxsize:
+                self.rejected += 1
+                command.future.set_exception(queue.Full('command queue is full: %s' % name))
+                return command.future
+
+            self.pending.append(command)
+            self.cond.notify()
+            return command.future
+
+    # 待ち行列からコマンドを取り出して，1つずつ順番に送信する
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or not self.running)
+                if not self.running:
+                    return
+                command = self.pending.popleft()
+
+            if not command.future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = getattr(self.tello, command.name)(*command.args)
+            except Exception as e:
+                command.future.set_exception(e)
+            else:
+                command.future.set_result(result)
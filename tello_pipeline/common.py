@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+# パッケージ内の各モジュールから使う定数と小さな関数
+
+import numpy as np              # バッファ確保のため
+
+MAIN_WINDOW = 'OpenCV Window'   # メインウィンドウ名(トラックバーもここに付く)
+BINARY_WINDOW = 'Binary Image'  # 2値画像ウィンドウ名
+
+
+# 形とdtypeが合っていれば前回のバッファをそのまま使い，違う時だけ確保し直す
+def ensure_buffer(buf, shape, dtype=np.uint8):
+    if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+        buf = np.empty(shape, dtype=dtype)
+    return buf
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# rcコマンドの4軸(a:左右, b:前後, c:上下, d:旋回)をまとめて計算するPID制御器
+
+import time                     # 時刻が渡されない時に使うため
+
+import numpy as np              # 4軸をまとめて計算するため
+
+
+class PidController:
+    # 各ゲインなどは4軸分の値(スカラーなら全軸同じ)
+    #   kp, ki, kd : 比例・積分・微分ゲイン(積分・微分は秒単位なのでフレームレートに依存しない)
+    #   deadband   : 出力の絶対値がこれ未満ならゼロにする(不感帯)
+    #   limit      : 出力の上限(ソフトウェアリミッタ．rcコマンドは±100)
+    #   max_dt     : 前回からこれ以上時間が空いたら，積分と微分をリセットする[秒]
+    def __init__(self, kp, ki=0.0, kd=0.0, deadband=0.0, limit=100.0, max_dt=0.5):
+        self.kp = np.broadcast_to(np.asarray(kp, dtype=np.float64), (4,)).copy()
+        self.ki = np.broadcast_to(np.asarray(ki, dtype=np.float64), (4,)).copy()
+        self.kd = np.broadcast_to(np.asarray(kd, dtype=np.float64), (4,)).copy()
+        self.deadband = np.broadcast_to(np.asarray(deadband, dtype=np.float64), (4,)).copy()
+        self.limit = np.broadcast_to(np.asarray(limit, dtype=np.float64), (4,)).copy()
+        self.max_dt = max_dt
+        self.integral = np.zeros(4)     # 偏差の積分
+        self.output = np.zeros(4)       # 最後の出力
+        self.reset()
+
+    # 積分と前回値を消す(追跡開始時や見失った時に呼ぶ)
+    def reset(self):
+        self.integral[:] = 0.0
+        self.prev_error = None      # 前回の偏差
+        self.prev_time = None       # 前回の時刻
+
+    # 偏差(4軸分)と時刻から，rcコマンドの値(4軸分のfloat配列)を計算する
+    def update(self, error, t=None):
+        if t is None:
+            t = time.perf_counter()
+        error = np.asarray(error, dtype=np.float64)
+
+        dt = None if self.prev_time is None else t - self.prev_time
+        if dt is not None and (dt <= 0.0 or dt > self.max_dt):
+            self.reset()
+            dt = None
+
+        # 微分項(前回の偏差が無ければ0)
+        derivative = np.zeros(4) if dt is None else (error - self.prev_error) / dt
+
+        # 積分項．出力が飽和していて，さらに飽和を強める向きの積分は止める(アンチワインドアップ)
+        if dt is not None:
+            saturated = (np.abs(self.output) >= self.limit) & (np.sign(self.output) == np.sign(error))
+            self.integral += np.where(saturated, 0.0, error * dt)
+            # 積分項だけで上限を超えないように積分値も制限する
+            bound = np.divide(self.limit, self.ki, out=np.full(4, np.inf), where=self.ki != 0)
+            np.clip(self.integral, -bound, bound, out=self.integral)
+
+        output = self.kp * error + self.ki * self.integral + self.kd * derivative
+
+        # 不感帯とソフトウェアリミッタ
+        output[np.abs(output) < self.deadband] = 0.0
+        np.clip(output, -self.limit, self.limit, out=output)
+
+        self.output = output
+        self.prev_error = error
+        self.prev_time = t
+        return output
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# 顔追跡で使う部品
+
+import multiprocessing          # 顔検出を別プロセスで行うため
+from multiprocessing import shared_memory  # フレームをコピーなしで渡すため
+import queue                    # 結果が無い時の例外を使うため
+import time                     # 検出時間を測るため
+
+import cv2                      # テンプレートマッチングのため
+import numpy as np              # 座標計算のため
+
+
+# 顔検出の設定
+#   scale_factor  : 探す顔の大きさを何倍ずつ変えるか(大きいほど速いが見落としやすい)
+#   min_neighbors : 何個重なった候補を顔とするか
+#   size_ratio    : 探す顔の幅を基準顔サイズの何倍から何倍までにするか(Noneなら10px以上すべて)
+#   downscale     : 顔検出する画像を何分の1に縮小するか
+# accurateは元のdetectMultiScale(gray, 1.1, 3, 0, (10, 10))と同じ
+DETECTION_PROFILES = {
+    'fast':     {'scale_factor': 1.3, 'min_neighbors': 3, 'size_ratio': (0.5, 2.5), 'downscale': 2},
+    'balanced': {'scale_factor': 1.2, 'min_neighbors': 3, 'size_ratio': (0.4, 3.0), 'downscale': 1},
+    'accurate': {'scale_factor': 1.1, 'min_neighbors': 3, 'size_ratio': None, 'downscale': 1},
+}
+
+
+# 設定に従ってカスケード分類器で顔検出するクラス
+class FaceDetector:
+    def __init__(self, casc_path, profile='accurate', target_width=80):
+        settings = DETECTION_PROFILES[profile] if isinstance(profile, str) else profile
+        self.face_cascade = cv2.CascadeClassifier(casc_path)   # カスケードクラスの作成
+        self.scale_factor = settings['scale_factor']
+        self.min_neighbors = settings['min_neighbors']
+        self.downscale = settings['downscale']
+
+        # 探す顔の大きさ(縮小した画像上の画素数)
+        ratio = settings['size_ratio']
+        if ratio is None:
+            self.min_size, self.max_size = (10, 10), (0, 0)     # (0,0)は上限なし
+        else:
+            low = max(int(target_width * ratio[0] / self.downscale), 10)
+            high = int(target_width * ratio[1] / self.downscale)
+            self.min_size, self.max_size = (low, low), (high, high)
+        self.small = None       # 縮小画像の出力バッファ
+
+    # グレイスケール画像から顔を検出して，元の画像での(x,y,w,h)の配列を返す
+    def detect(self, gray):
+        scale = self.downscale
+        if scale > 1:
+            size = (gray.shape[1] // scale, gray.shape[0] // scale)
+            if self.small is None or self.small.shape != (size[1], size[0]):
+                self.small = np.empty((size[1], size[0]), dtype=np.uint8)
+            gray = cv2.resize(gray, size, dst=self.small, interpolation=cv2.INTER_AREA)
+        faces = self.face_cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors, 0,
+                                                   self.min_size, self.max_size)
+        if len(faces) > 0 and scale > 1:
+            faces = faces * scale
+        return faces
+
+
+# 顔検出の合間に，検出した顔の画像をテンプレートにして位置を追いかけるクラス
+# 前回の位置の周りだけでmatchTemplateするので，カスケード分類器よりずっと軽い
+class TemplateTracker:
+    def __init__(self, search=0.75, min_score=0.6):
+        self.search = search        # 探す範囲をボックスの何倍分広げるか
+        self.min_score = min_score  # 相関がこれより低ければ見失ったとみなす
+        self.template = None        # 顔のグレイスケール画像
+        self.box = None             # 最後の位置(x,y,w,h)
+        self.gray = None            # 探す範囲のグレイスケール画像の出力バッファ
+
+    def active(self):
+        return self.box is not None
+
+    def reset(self):
+        self.template = None
+        self.box = None
+
+    # 検出した顔のボックスでテンプレートを作り直す
+    def init(self, image, box):
+        x, y, w, h = (int(v) for v in box)
+        if w < 4 or h < 4:
+            self.reset()
+            return
+        self.template = cv2.cvtColor(image[y:y+h, x:x+w], cv2.COLOR_BGR2GRAY)
+        self.box = (x, y, w, h)
+
+    # 前回の位置の周りでテンプレートを探す．見つかればボックス，見失えばNoneを返す
+    def update(self, image):
+        if self.box is None:
+            return None
+        x, y, w, h = self.box
+        pad_x = max(int(w * self.search), 4)
+        pad_y = max(int(h * self.search), 4)
+        x0, y0 = max(x - pad_x, 0), max(y - pad_y, 0)
+        x1, y1 = min(x + w + pad_x, image.shape[1]), min(y + h + pad_y, image.shape[0])
+        if x1 - x0 < w or y1 - y0 < h:      # 画面の端で探す範囲がテンプレートより小さくなった
+            self.reset()
+            return None
+
+        # 探す範囲だけグレイスケールにする(バッファは大きさが変わった時だけ確保し直す)
+        if self.gray is None or self.gray.shape != (y1 - y0, x1 - x0):
+            self.gray = np.empty((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+        result = cv2.matchTemplate(self.gray, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (mx, my) = cv2.minMaxLoc(result)
+        if score < self.min_score:
+            self.reset()
+            return None
+        self.box = (x0 + mx, y0 + my, w, h)
+        return self.box
+
+
+# 別プロセスで顔検出するクラス
+# フレームは共有メモリに書き込んで渡すので，画像をpickleしてプロセス間で送らない．
+# 検出中に来たフレームは渡さず(最新のフレームだけを検出する)，結果は取得時刻付きで返る
+class FaceDetectWorker:
+    def __init__(self, casc_path, max_shape=(480, 480, 3), profile='accurate', target_width=80):
+        self.max_shape = max_shape      # 渡せる画像の最大の大きさ(カメラ切替で縦横が変わっても入るように)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(max_shape)))
+        context = multiprocessing.get_context('spawn')     # OpenCVのスレッドをforkで引き継がないように
+        self.jobs = context.Queue()         # (画像の形, 通し番号, 取得時刻) を送る
+        self.results = context.Queue()      # (通し番号, 取得時刻, 顔の配列, 検出時間) を受け取る
+        self.process = context.Process(
+            target=_detect_worker, args=(self.shm.name, casc_path, profile, target_width, self.jobs, self.results),
+            daemon=True)
+        self.process.start()
+        self.busy = False           # 検出中のフレームがあるか
+        self.shape = None           # 検出中のフレームの形
+        self.submitted = 0          # 検出を頼んだフレーム数
+        self.skipped = 0            # 検出中だったので渡さなかったフレーム数
+
+    # 共有メモリ上の，最後に渡したフレーム(結果が返るまでは書き換えない)
+    def frame(self):
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    # 検出中でなければフレームを共有メモリに書き込んで検出を頼む．頼んだらTrueを返す
+    def submit(self, image, seq=0, timestamp=None):
+        if self.busy:
+            self.skipped += 1
+            return False
+        self.shape = image.shape
+        np.copyto(self.frame(), image)
+        self.jobs.put((image.shape, seq, timestamp))
+        self.busy = True
+        self.submitted += 1
+        return True
+
+    # 新しい結果(seq, timestamp, faces, elapsed)が返っていれば最新のものを返す．無ければNone
+    def poll(self):
+        result = None
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                break
+        if result is not None:
+            self.busy = False
+        return result
+
+    def close(self):
+        self.jobs.put(None)
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.shm.close()
+        self.shm.unlink()
+
+
+# ワーカープロセスの本体．共有メモリのフレームで顔検出して結果を返す
+def _detect_worker(shm_name, casc_path, profile, target_width, jobs, results):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    detector = FaceDetector(casc_path, profile, target_width)
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            shape, seq, timestamp = job
+            start = time.perf_counter()
+            image = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            cv2.equalizeHist(gray, dst=gray)
+            faces = detector.detect(gray)
+            faces = [tuple(int(v) for v in face) for face in faces]
+            results.put((seq, timestamp, faces, time.perf_counter() - start))
+    finally:
+        shm.close()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import threading                # 受信フレームを監視するスレッドを使うため
+import time                     # 取得時刻を記録するため
+
+
+# 通し番号と取得時刻の付いた1フレーム
+class Frame:
+    __slots__ = ('seq', 'timestamp', 'image')
+
+    def __init__(self, seq, timestamp, image):
+        self.seq = seq              # 1から始まる通し番号(単調増加)
+        self.timestamp = timestamp  # 新しいフレームに気付いた時刻(time.perf_counter)
+        self.image = image          # 画像そのもの(コピーはしない)
+
+
+# BackgroundFrameReadの最新フレームだけを，通し番号付きで受け渡すクラス
+# frame_read.frame は同じ画像が何度でも読めてしまうので，画像オブジェクトが
+# 入れ替わった時だけ新しいフレームとして番号を振る
+class FrameSource:
+    def __init__(self, frame_read, poll_interval=0.001):
+        self.frame_read = frame_read        # djitellopyのBackgroundFrameRead
+        self.poll_interval = poll_interval  # フレームの入れ替わりを調べる間隔[秒]
+
+        self.cond = threading.Condition()   # 新フレーム到着を待つための条件変数
+        self.latest = None      # 最新フレーム
+        self.consumed = 0       # 最後に受け取られたフレームの通し番号
+
+        # 統計用のカウンタ
+        self.received = 0       # 新しいフレームとして番号を振った枚数
+        self.dropped = 0        # 処理される前に次のフレームで上書きされた枚数
+        self.duplicates = 0     # 新しいフレームが無いのに読もうとした回数(wait_nextでは待つことになった回数)
+        self.timeouts = 0       # wait_nextがタイムアウトした回数
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._poll, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # 受信スレッドが画像を差し替えたかを監視して，差し替わったら番号を振る
+    def _poll(self):
+        last_image = None
+        while self.running:
+            image = self.frame_read.frame
+            if image is not None and image is not last_image:
+                last_image = image
+                self.publish(image)
+            else:
+                time.sleep(self.poll_interval)
+
+    # 新しいフレームを登録して，待っているスレッドを起こす
+    def publish(self, image, timestamp=None):
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        with self.cond:
+            self.received += 1
+            self.latest = Frame(self.received, timestamp, image)
+            self.cond.notify_all()
+
+    # まだ受け取っていないフレームを取り出す(呼び出し側はロックを持っていること)
+    def _take(self):
+        frame = self.latest
+        if frame is None or frame.seq <= self.consumed:
+            return None
+        self.dropped += frame.seq - self.consumed - 1     # 飛ばされた分は処理されずに捨てられた
+        self.consumed = frame.seq
+        return frame
+
+    # 新しいフレームがあれば返し，無ければ待たずにNoneを返す
+    def read(self):
+        with self.cond:
+            frame = self._take()
+            if frame is None:
+                self.duplicates += 1
+            return frame
+
+    # 新しいフレームが来るまで最大timeout秒待つ．来なければNoneを返す
+    def wait_next(self, timeout=1.0):
+        with self.cond:
+            frame = self._take()
+            if frame is None:
+                self.duplicates += 1        # 新しいフレームが無かったので待つ
+                self.cond.wait_for(lambda: self.latest is not None and self.latest.seq > self.consumed, timeout)
+                frame = self._take()
+                if frame is None:
+                    self.timeouts += 1
+            return frame
+
+    # カウンタをまとめて返す
+    def stats(self):
+        with self.cond:
+            return {'received': self.received, 'consumed': self.consumed,
+                    'dropped': self.dropped, 'duplicates': self.duplicates,
+                    'timeouts': self.timeouts}
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# ループの各段階(取得・前処理・各ステージ・描画・表示・キー入力)の処理時間を測るクラス
+# 段階ごとに直近size回分の時間を固定長のリングバッファに入れておき，
+# p50/p95/p99をその場で計算する．'p'キーで表示，終了時にCSVかJSONへ書き出せる
+# rcコマンドの元になったフレームの古さ(rc_set_age, rc_send_age)もここに記録される
+
+import csv                      # CSVで書き出すため
+import json                     # JSONで書き出すため
+import threading                # rc送信スレッドからも記録するため
+import time                     # perf_counter_nsを使うため
+
+import numpy as np              # リングバッファとパーセンタイルの計算のため
+
+
+# 固定長のリングバッファ(古い値から上書きされる)
+class RingBuffer:
+    def __init__(self, size, dtype=np.int64):
+        self.data = np.zeros(size, dtype=dtype)
+        self.index = 0          # 次に書き込む位置
+        self.count = 0          # これまでに書き込んだ数
+
+    def append(self, value):
+        self.data[self.index] = value
+        self.index = (self.index + 1) % len(self.data)
+        self.count += 1
+
+    # 入っている値(書き込んだ順とは限らない)
+    def values(self):
+        return self.data[:min(self.count, len(self.data))]
+
+
+class StageTimer:
+    def __init__(self, size=1024):
+        self.size = size
+        self.lock = threading.Lock()    # 別スレッドからの記録と集計がぶつからないように
+        self.buffers = {}       # 段階名 -> 処理時間[ns]のリングバッファ(登録した順に並ぶ)
+        self.frames = RingBuffer(size)  # フレームを処理し終えた時刻[ns](FPSの計算用)
+
+    # 処理時間[ns]を記録する
+    def record(self, name, elapsed_ns):
+        with self.lock:
+            buffer = self.buffers.get(name)
+            if buffer is None:
+                buffer = self.buffers[name] = RingBuffer(self.size)
+            buffer.append(elapsed_ns)
+
+    # startから今までの時間を記録して，今の時刻を返す(次の段階のstartに使える)
+    def lap(self, name, start):
+        now = time.perf_counter_ns()
+        self.record(name, now - start)
+        return now
+
+    # 1フレームの処理が終わった時に呼ぶ
+    def frame_done(self):
+        self.frames.append(time.perf_counter_ns())
+
+    # 直近のフレームから計算したFPS
+    def fps(self):
+        stamps = self.frames.values()
+        if len(stamps) < 2:
+            return 0.0
+        return (len(stamps) - 1) * 1e9 / float(stamps.max() - stamps.min())
+
+    # 段階名 -> {count, mean, p50, p95, p99, max}(時間はms)
+    def report(self):
+        report = {}
+        with self.lock:
+            buffers = [(name, buffer.count, buffer.values() / 1e6) for name, buffer in self.buffers.items()]
+        for name, count, values in buffers:
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            report[name] = {'count': count, 'mean': float(values.mean()), 'p50': float(p50),
+                            'p95': float(p95), 'p99': float(p99), 'max': float(values.max())}
+        return report
+
+    def print_report(self):
+        print('%.1f fps (last %d frames)' % (self.fps(), len(self.frames.values())))
+        print('%-22s %7s %8s %8s %8s %8s %8s' % ('stage [ms]', 'count', 'mean', 'p50', 'p95', 'p99', 'max'))
+        for name, row in self.report().items():
+            print('%-22s %7d %8.3f %8.3f %8.3f %8.3f %8.3f' % (name, row['count'], row['mean'], row['p50'],
+                                                              row['p95'], row['p99'], row['max']))
+
+    # 拡張子が.jsonならJSON，それ以外はCSVで書き出す
+    def dump(self, path):
+        report = self.report()
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump({'fps': self.fps(), 'stages': report}, f, indent=2)
+            return
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'])
+            for name, row in report.items():
+                writer.writerow([name, row['count'], row['mean'], row['p50'], row['p95'], row['p99'], row['max']])
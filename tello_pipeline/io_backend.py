@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# 表示とキー入力の切り替え
+#   OpenCVBackend    : 今まで通りimshowとwaitKey
+#   ThrottledBackend : Nフレームに1回だけimshowする(キー入力は毎回見る)
+#   HeadlessBackend  : ウィンドウを出さない．キーは標準入力・UDP・スクリプトファイルから
+#
+# 環境変数TELLO_BACKENDで選べる(backend_from_envを参照)
+#   opencv / throttled:3 / headless / headless:stdin / headless:udp:9000 / headless:keys.txt
+
+import os                       # 環境変数を読むため
+import queue                    # 別スレッドから受け取ったキーを溜めるため
+import socket                   # UDPでキーを受け取るため
+import sys                      # 標準入力を読むため
+import threading                # キー入力を別スレッドで待つため
+import time                     # スクリプトのキーを時刻通りに出すため
+
+import cv2                      # OpenCVを使うため
+
+from .common import MAIN_WINDOW
+
+NO_KEY = 0xFF       # キー入力が無い時の値(waitKeyの-1を0xFFでマスクした値と同じ)
+
+# 1文字で書けないキーの名前
+KEY_NAMES = {'esc': 27, 'space': ord(' ')}
+
+
+# 今まで通りOpenCVのウィンドウに表示して，waitKeyでキーを読む
+class OpenCVBackend:
+    has_window = True       # トラックバーを使えるか
+
+    def open(self):
+        # トラックバーを作るため，まず最初にウィンドウを生成
+        cv2.namedWindow(MAIN_WINDOW)
+
+    # このフレームは表示されるか(表示しないなら表示用の画像を作らなくてよい)
+    def wants_frame(self):
+        return True
+
+    # ウィンドウ名 -> 画像 の辞書を表示する
+    def show(self, views):
+        for name, view in views.items():
+            cv2.imshow(name, view)
+
+    # OpenCVウィンドウでキー入力を1ms待つ
+    def poll_key(self):
+        return cv2.waitKey(1) & 0xFF
+
+    def close(self):
+        cv2.destroyAllWindows()     # すべてのOpenCVウィンドウを消去
+
+
+# Nフレームに1回だけ表示する．キー入力は毎回waitKeyで読む
+class ThrottledBackend(OpenCVBackend):
+    def __init__(self, every=3):
+        self.every = every      # 何フレームに1回表示するか
+        self.count = 0          # 表示を頼まれたフレーム数
+
+    def wants_frame(self):
+        return self.count % self.every == 0
+
+    def show(self, views):
+        if self.wants_frame():
+            super().show(views)
+        self.count += 1
+
+
+# ウィンドウを出さずに動かす．キー入力は別スレッドが集めてキューに入れる
+class HeadlessBackend:
+    has_window = False
+
+    def __init__(self, keys='stdin'):
+        self.keys = keys            # 'stdin' / 'udp:ポート番号' / スクリプトファイルのパス / None(キー無し)
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def open(self):
+        if self.keys is None:
+            return
+        if self.keys == 'stdin':
+            target, args = self._read_stdin, ()
+        elif self.keys.startswith('udp:'):
+            target, args = self._read_udp, (int(self.keys[4:]),)
+        else:
+            target, args = self._read_script, (self.keys,)
+        self.thread = threading.Thread(target=target, args=args, daemon=True)
+        self.thread.start()
+
+    def wants_frame(self):
+        return False
+
+    def show(self, views):
+        pass
+
+    def poll_key(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return NO_KEY
+
+    def close(self):
+        pass
+
+    # 'esc'や'space'などの名前か，1文字ずつのキーとしてキューに入れる
+    def _push(self, text):
+        text = text.strip()
+        if text.lower() in KEY_NAMES:
+            self.queue.put(KEY_NAMES[text.lower()])
+            return
+        for ch in text:
+            self.queue.put(ord(ch) & 0xFF)
+
+    # 標準入力の1行をキー入力とする(Enterで確定)
+    def _read_stdin(self):
+        for line in sys.stdin:
+            self._push(line)
+
+    # UDPで受け取った文字列をキー入力とする(例: echo -n t | nc -u -w0 localhost 9000)
+    def _read_udp(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', port))
+        while True:
+            data, _ = sock.recvfrom(256)
+            self._push(data.decode('utf-8', errors='replace'))
+
+    # "秒 キー" を1行ずつ書いたファイルの通りにキー入力する(#から後はコメント)
+    #   2.0 t
+    #   5.0 1
+    #   30.0 esc
+    def _read_script(self, path):
+        start = time.perf_counter()
+        with open(path) as f:
+            for line in f:
+                line = line.split('#')[0].strip()
+                if not line:
+                    continue
+                at, text = line.split(None, 1)
+                delay = float(at) - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+                self._push(text)
+
+
+# 環境変数TELLO_BACKENDの内容からバックエンドを作る
+def backend_from_env(default='opencv'):
+    spec = os.environ.get('TELLO_BACKEND', default)
+    name, _, arg = spec.partition(':')
+    if name == 'opencv':
+        return OpenCVBackend()
+    elif name == 'throttled':
+        return ThrottledBackend(int(arg) if arg else 3)
+    elif name == 'headless':
+        return HeadlessBackend(arg if arg else 'stdin')
+    raise ValueError('unknown TELLO_BACKEND: %s' % spec)
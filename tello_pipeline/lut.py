@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# BGR値 -> 2値(またはクラス番号) の表を使った2値化
+# H/S/Vの範囲が変わった時だけ全色分のcvtColor+inRangeで表を作り，毎フレームは
+# 画素のBGR値から表を引くだけにする．bits=5なら32x32x32(32KB)に量子化した表，
+# bits=8なら256^3(16MB)の完全な表を使う．
+
+import cv2                      # 表を作る時のHSV変換のため
+import numpy as np              # 表引きのため
+
+
+# Hueの範囲でinRangeする．h_min > h_maxなら0/179をまたぐ範囲(赤など)として扱う
+def in_hsv_range(hsv, lower, upper, dst=None):
+    if lower[0] <= upper[0]:
+        return cv2.inRange(hsv, lower, upper, dst=dst)
+    # h_min..179 と 0..h_max の2つに分けてORを取る
+    upper_wrap = np.array((179, upper[1], upper[2]), dtype=np.uint8)
+    lower_wrap = np.array((0, lower[1], lower[2]), dtype=np.uint8)
+    mask = cv2.inRange(hsv, lower, upper_wrap, dst=dst)
+    other = cv2.inRange(hsv, lower_wrap, upper)
+    return cv2.bitwise_or(mask, other, dst=mask)
+
+
+# 表の各項目が表すBGR色を並べた画像を作る(量子化した時は各区間の中央の色)
+def _lut_colors(bits):
+    levels = 1 << bits
+    step = 256 // levels
+    values = (np.arange(levels, dtype=np.uint16) * step + step // 2).astype(np.uint8)
+    b, g, r = np.meshgrid(values, values, values, indexing='ij')    # 表の番号は b,g,r の順
+    colors = np.stack((b, g, r), axis=-1).reshape(-1, 1, 3)
+    return colors
+
+
+# H/S/Vの範囲のリストから表を作る．i番目の範囲に入る色はvalues[i]になる(後の範囲が優先)
+def build_hsv_lut(ranges, bits=5, values=None):
+    if values is None:
+        values = [255] * len(ranges)
+    hsv = cv2.cvtColor(_lut_colors(bits), cv2.COLOR_BGR2HSV)
+    lut = np.zeros(hsv.shape[0], dtype=np.uint8)
+    for (lower, upper), value in zip(ranges, values):
+        mask = in_hsv_range(hsv, lower, upper).reshape(-1)
+        lut[mask != 0] = value
+    return lut
+
+
+# 画像の各画素のBGR値を表の番号に変換して表を引く(出力バッファは使い回す)
+class LutClassifier:
+    def __init__(self, bits=5):
+        self.bits = bits
+        self.shape = None
+        self.quantized = None   # 量子化したBGR(bits=5の時だけ使う)
+        self.index = None       # 表の番号
+        self.temp = None        # 番号を組み立てる時の一時バッファ
+
+    def _allocate(self, shape):
+        dtype = np.uint16 if self.bits * 3 <= 16 else np.uint32
+        self.shape = shape
+        self.quantized = np.empty(shape, dtype=np.uint8)
+        self.index = np.empty(shape[:2], dtype=dtype)
+        self.temp = np.empty(shape[:2], dtype=dtype)
+
+    def apply(self, image, lut, out):
+        if image.shape != self.shape:
+            self._allocate(image.shape)
+        bits = self.bits
+        dtype = self.index.dtype
+
+        src = image
+        if bits < 8:
+            src = np.right_shift(image, 8 - bits, out=self.quantized)
+
+        # 番号 = b << 2bits | g << bits | r
+        np.left_shift(src[:, :, 0], 2 * bits, out=self.index, dtype=dtype)
+        np.left_shift(src[:, :, 1], bits, out=self.temp, dtype=dtype)
+        np.bitwise_or(self.index, self.temp, out=self.index)
+        np.bitwise_or(self.index, src[:, :, 2], out=self.index, dtype=dtype)
+
+        np.take(lut, self.index, out=out)
+        return out
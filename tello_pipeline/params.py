@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import json                     # パラメータをファイルに保存するため
+
+import cv2                      # トラックバーを使うため
+import numpy as np              # inRangeに渡す上下限の配列を作るため
+
+from .common import MAIN_WINDOW
+
+
+# inRangeの上下限をまとめて持つクラス
+# トラックバーのコールバックで値を更新するので，毎フレームgetTrackbarPosを呼ばなくてよい
+class ThresholdParams:
+    def __init__(self, channels):
+        self.channels = channels    # (名前, 最大値)の組．例: (("H", 179), ("S", 255), ("V", 255))
+        self.lower = np.zeros(len(channels), dtype=np.uint8)                            # 下限の配列
+        self.upper = np.array([maximum for _, maximum in channels], dtype=np.uint8)     # 上限の配列
+        self.version = 0            # 値が変わるたびに増える(上下限から作る表などの作り直しの判定用)
+
+    # トラックバー名("H_min"など)で値を設定する
+    def set(self, name, value):
+        channel, _, bound = name.rpartition('_')
+        index = [n for n, _ in self.channels].index(channel)
+        array = self.lower if bound == 'min' else self.upper
+        array[index] = value
+        self.version += 1
+
+    # トラックバー名 -> 値 の辞書
+    def values(self):
+        values = {}
+        for index, (name, _) in enumerate(self.channels):
+            values[name + '_min'] = int(self.lower[index])
+            values[name + '_max'] = int(self.upper[index])
+        return values
+
+    # トラックバーを作る．コールバックで値が更新される
+    def create_trackbars(self, window=MAIN_WINDOW):
+        for name, value in self.values().items():
+            maximum = dict(self.channels)[name.rpartition('_')[0]]
+            cv2.createTrackbar(name, window, value, maximum, lambda x, name=name: self.set(name, x))
+
+    # JSONファイルから読み込む
+    def load(self, path):
+        with open(path) as f:
+            values = json.load(f)
+        for name, value in values.items():
+            self.set(name, value)
+        return self
+
+    # JSONファイルに保存する
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.values(), f, indent=2)
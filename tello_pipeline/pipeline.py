@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+
+from djitellopy import Tello    # DJITelloPyのTelloクラスをインポート
+import os                       # 環境変数で接続先を変えられるように
+import time                     # time.sleepを使いたいので
+import cv2                      # OpenCVを使うため
+
+from .common import MAIN_WINDOW
+from .preprocess import Preprocessor
+from .frame_source import FrameSource
+from .command import CommandExecutor
+from .rc_sender import RcSender
+from .io_backend import NO_KEY, backend_from_env
+from .instrument import StageTimer
+from .recording import FlightRecorder, ReplaySource
+from .threaded import ThreadedLoop
+from .scheduler import FrameScheduler
+
+TELLO_HOST = os.environ.get('TELLO_HOST', '192.168.10.1')   # 接続先(シミュレータを使う時は環境変数で変える)
+
+
+# 1フレーム分の画像と処理結果を，ステージ間で持ち回るための入れ物
+class FrameContext:
+    def __init__(self, image, seq=0, timestamp=None):
+        self.image = image      # リサイズ・回転後のBGR画像
+        self.seq = seq              # フレームの通し番号
+        self.timestamp = timestamp  # フレームの取得時刻(time.perf_counter)
+        self.hsv = None         # HSV画像(HSVステージが埋める)
+        self.mask = None        # 2値画像(2値化ステージが埋める)
+        self.result = None      # マスク適用画像(2値化ステージが埋める)
+        self.target = None      # 追跡対象のx,y,w,h(追跡ステージが埋める)
+        self.labels = None      # 描画するラベルの(stats, center)(ラベリングステージが埋める)
+        self.blob = None        # 面積最大のラベル(色追跡ステージが埋める)
+        self.classes = None     # 画素ごとの色のクラス番号(0は背景．多色分類ステージが埋める)
+        self.blobs = None       # 色の名前 -> その色の面積最大のラベル(多色分類ステージが埋める)
+        self.degraded = False   # 処理が遅れていて，後回しにできる処理を省くフレームか(FrameSchedulerが決める)
+        self.views = {}         # ウィンドウ名 -> 表示する画像
+
+    # ウィンドウに表示する画像を登録する
+    def show(self, name, image):
+        self.views[name] = image
+
+
+# Telloとの接続，フレーム取得，前処理，ステージ実行，表示，キー入力をまとめたクラス
+class TelloPipeline:
+    def __init__(self, stages=(), size=(480, 360), interpolation=cv2.INTER_AREA, rc_rate=20.0, host=TELLO_HOST,
+                 backend=None, force_overlay=False, camera=Tello.CAMERA_FORWARD, threaded=None, cv_threads=None,
+                 deadline=None):
+        self.stages = list(stages)  # 画像処理ステージのリスト(順番に実行される)
+        self.host = host            # TelloのIPアドレス
+        self.backend = backend if backend is not None else backend_from_env()  # 表示とキー入力(省略時は環境変数TELLO_BACKENDで選ぶ)
+        # Trueなら表示しないフレームでも描画処理を行う(ヘッドレスで描画のコストを測る時に使う)
+        self.force_overlay = force_overlay or os.environ.get('TELLO_FORCE_OVERLAY') == '1'
+        self.preprocessor = Preprocessor(size, interpolation)  # 縮小・回転の前処理(INTER_NEARESTにすると速い)
+        self.rc_rate = rc_rate      # 自動モードのrcコマンドの送信周波数[Hz]
+        # Trueなら取得・画像処理・表示を別々のスレッドで並行に動かす(省略時は環境変数TELLO_THREADED=1)
+        self.threaded = threaded if threaded is not None else os.environ.get('TELLO_THREADED') == '1'
+        # OpenCV内部の並列処理のスレッド数(省略時は環境変数TELLO_CV_THREADS，無ければOpenCVに任せる)
+        if cv_threads is None and os.environ.get('TELLO_CV_THREADS'):
+            cv_threads = int(os.environ['TELLO_CV_THREADS'])
+        self.cv_threads = cv_threads
+        # 1フレームの処理の締め切り[秒]．指定すると遅れた時に描画などを省く(省略時は環境変数TELLO_DEADLINE_MS)
+        if deadline is None and os.environ.get('TELLO_DEADLINE_MS'):
+            deadline = float(os.environ['TELLO_DEADLINE_MS']) / 1000.0
+        self.scheduler = FrameScheduler(deadline)
+
+        self.tello = None
+        self.frame_read = None
+        self.source = None          # 通し番号付きで新しいフレームだけを渡すFrameSource
+        self.commands = None        # 応答待ちのあるコマンドを別スレッドで送るCommandExecutor
+        self.rc = None              # rcコマンドを一定周期で送るRcSender
+        self.sdk_ver = None
+
+        # モータとカメラの切替フラグ
+        self.motor_on = False                   # モータON/OFFのフラグ
+        self.camera_dir = camera                # 前方/下方カメラの方向のフラグ(最初に使うカメラ)
+        self.camera_settle = 0.5                # カメラを切り替えてから映像が切り替わるまで処理しない時間[秒]
+        self.settle_until = 0.0                 # この時刻(time.perf_counter)より前に取得したフレームは処理しない
+        self.auto_mode = 0                      # 自動モードフラグ
+
+        self.shape = None           # 前回の前処理後の画像の形(変わったらバッファを確保し直す)
+        self.timer = StageTimer()   # 段階ごとの処理時間
+        self.frame_time = None      # 処理中のフレームの取得時刻(rcコマンドに付ける)
+        self.timings_file = os.environ.get('TELLO_TIMINGS')     # 終了時に処理時間を書き出すファイル(.csvか.json)
+
+        # 映像の記録と再生
+        self.record_path = os.environ.get('TELLO_RECORD')       # 映像・ステータス・キーを記録するディレクトリ
+        self.replay_path = os.environ.get('TELLO_REPLAY')       # Telloの代わりに再生するディレクトリ(末尾':realtime'で実時間)
+        self.recorder = None        # FlightRecorder
+
+    # ステージを追加する
+    def add_stage(self, stage):
+        self.stages.append(stage)
+        return stage
+
+    # 初期化部
+    def connect(self):
+        self.set_cv_threads()
+
+        # Telloクラスを使って，tellというインスタンス(実体)を作る
+        # コマンドは別スレッドで送るので，応答のタイムアウトはデフォルト(7秒)のままで映像は止まらない
+        tello = Tello(host=self.host, retry_count=1)    # 応答が来ないときのリトライ回数は1(デフォルトは3)
+        self.tello = tello
+
+        # Telloへ接続
+        tello.connect()
+
+        # 画像転送を有効にする
+        tello.streamoff()   # 誤動作防止の為、最初にOFFする
+        tello.streamon()    # 画像転送をONに
+        self.frame_read = tello.get_frame_read()    # 画像フレームを取得するBackgroundFrameReadクラスのインスタンスを作る
+        self.source = FrameSource(self.frame_read).start()  # 新しいフレームが来た時だけ処理するため
+
+        # SDKバージョンを問い合わせ
+        self.sdk_ver = tello.query_sdk_version()
+
+        # 前回強制終了して下方カメラかもしれないので，最初に使うカメラを必ず設定する
+        if self.sdk_ver == '30':                                # SDK 3.0に対応しているか？
+            tello.set_video_direction(self.camera_dir)          # 普通は前方，ライントレースは下方
+        else:
+            self.camera_dir = Tello.CAMERA_FORWARD              # 切替できないので前方のまま
+
+        # ループ中のコマンドは別スレッドから送る
+        self.commands = CommandExecutor(tello, callback=_report_failure).start()  # 失敗したらprintする
+        self.rc = RcSender(tello, rate=self.rc_rate, timer=self.timer).start()     # rcコマンドは一定周期で，変化した時だけ送る
+
+        if self.record_path:        # 指定があれば映像を記録する
+            self.recorder = FlightRecorder(self.record_path).start()
+
+        # トラックバーを作るため，まず最初にウィンドウを生成(ヘッドレスならキー入力の準備だけ)
+        self.backend.open()
+
+        for stage in self.stages:
+            stage.setup(self)
+
+        time.sleep(0.5)     # 通信が安定するまでちょっと待つ
+
+    # OpenCV内部の並列処理のスレッド数を設定する(プロセス全体で1つの設定)
+    # スレッド版では画像処理スレッドと取得スレッドが同時に動くので，コア数より少なめにするとよい
+    def set_cv_threads(self):
+        if self.cv_threads is not None:
+            cv2.setNumThreads(self.cv_threads)
+
+    # 画像サイズ変更と、カメラ方向による回転(結果は前処理の出力バッファに上書きされる)
+    def preprocess(self, image):
+        return self.preprocessor(image, self.camera_dir)
+
+    # 1フレーム分の前処理と画像処理を行う(Telloが無くても画像さえあれば呼べる)
+    # ここでは制御に必要な処理だけを行い，表示用の描画はrenderで行う
+    def process_frame(self, image, seq=0, timestamp=None):
+        start = time.perf_counter_ns()
+        small_image = self.preprocess(image)
+        self.timer.lap('preprocess', start)
+        return self.process_stages(small_image, seq, timestamp)
+
+    # 前処理済みの画像にステージの画像処理を行う
+    def process_stages(self, small_image, seq=0, timestamp=None):
+        timer = self.timer
+        start = time.perf_counter_ns()
+
+        # 画像の形が変わったら(カメラ切替で縦横が入れ替わるなど)出力バッファを確保し直す
+        if small_image.shape != self.shape:
+            self.shape = small_image.shape
+            for stage in self.stages:
+                stage.allocate(self.shape)
+
+        ctx = FrameContext(small_image, seq, timestamp)
+        self.frame_time = timestamp
+        ctx.degraded = self.scheduler.begin(timestamp)
+
+        for stage in self.stages:
+            stage.process(ctx, self)
+            start = timer.lap(type(stage).__name__, start)
+
+        self.scheduler.end()
+        return ctx
+
+    # このフレームを描画するか(表示しないフレームと，締め切りを過ぎたフレームは描画しない)
+    def wants_overlay(self):
+        return (self.force_overlay or self.backend.wants_frame()) and not self.scheduler.shed_overlay()
+
+    # 表示用の描画を行う(表示しないフレームでは呼ばない)
+    def render(self, ctx):
+        ctx.show(MAIN_WINDOW, ctx.image)    # ステージが上書きしなければ元画像を表示
+        for stage in self.stages:
+            stage.overlay(ctx, self)
+        if ctx.degraded:                    # 遅れている間は2値画像などの副ウィンドウを出さない
+            ctx.views = {MAIN_WINDOW: ctx.views[MAIN_WINDOW]}
+        return ctx
+
+    # rcコマンドを送信(実際の送信はRcSenderが一定周期で行う)
+    # 今処理しているフレームの取得時刻を一緒に渡して，送信時にフレームの古さを記録する
+    # 制御量を前のフレームの結果から計算した時は，そのフレームの取得時刻をframe_timeに渡す
+    def send_rc(self, a, b, c, d, frame_time=None):
+        self.rc.set(a, b, c, d, frame_time if frame_time is not None else self.frame_time)
+
+    # rcコマンドの停止(0,0,0,0)をすぐに送る
+    def stop_rc(self):
+        self.rc.stop_motion()
+
+    # コマンドを別スレッドに依頼する．完了はFutureで受け取れる
+    def command(self, name, *args, clear=False):
+        return self.commands.submit(name, *args, clear=clear)
+
+    # キー入力の処理．ループを終了する時はFalseを返す
+    def handle_key(self, key):
+        if key == 27:                   # key が27(ESC)だったらwhileループを脱出，プログラム終了
+            return False
+        elif key == ord('t'):           # 離陸
+            self.command('takeoff')
+        elif key == ord('l'):           # 着陸(送信待ちのコマンドは取り消して最優先で)
+            self.stop_rc()
+            self.command('land', clear=True)
+        elif key == ord('w'):           # 前進 30cm
+            self.command('move_forward', 30)
+        elif key == ord('s'):           # 後進 30cm
+            self.command('move_back', 30)
+        elif key == ord('a'):           # 左移動 30cm
+            self.command('move_left', 30)
+        elif key == ord('d'):           # 右移動 30cm
+            self.command('move_right', 30)
+        elif key == ord('e'):           # 旋回-時計回り 30度
+            self.command('rotate_clockwise', 30)
+        elif key == ord('q'):           # 旋回-反時計回り 30度
+            self.command('rotate_counter_clockwise', 30)
+        elif key == ord('r'):           # 上昇 30cm
+            self.command('move_up', 30)
+        elif key == ord('f'):           # 下降 30cm
+            self.command('move_down', 30)
+        elif key == ord('p'):           # ステータスをprintする
+            print(self.tello.get_current_state())
+            self.timer.print_report()       # 段階ごとの処理時間も
+            print(self.source.stats())      # フレームの受信・取りこぼし枚数も
+            print(self.rc.stats())          # rcコマンドの送信・削減数も
+            print(self.scheduler.stats())   # 捨てた・省いたフレーム数も
+        elif key == ord('m'):           # モータ始動/停止を切り替え
+            if self.sdk_ver == '30':    # SDK 3.0に対応しているか？
+                # フラグはコマンドが成功してから変える(失敗したらTelloの状態と食い違わないように)
+                if self.motor_on == False:  # 停止中なら始動
+                    future = self.command('turn_motor_on')
+                    future.add_done_callback(_on_success(lambda: setattr(self, 'motor_on', True)))
+                else:                       # 回転中なら停止
+                    future = self.command('turn_motor_off')
+                    future.add_done_callback(_on_success(lambda: setattr(self, 'motor_on', False)))
+        elif key == ord('c'):           # カメラの前方/下方の切り替え
+            if self.sdk_ver == '30':    # SDK 3.0に対応しているか？
+                if self.camera_dir == Tello.CAMERA_FORWARD:    # 前方なら下方へ変更
+                    direction = Tello.CAMERA_DOWNWARD
+                else:                                          # 下方なら前方へ変更
+                    direction = Tello.CAMERA_FORWARD
+                # 切り替わるまでは前のカメラの映像が来るので，フラグはコマンドが成功してから変える
+                future = self.command('set_video_direction', direction)
+                future.add_done_callback(_on_success(lambda: self.camera_switched(direction)))
+        elif self.handle_auto_key(key):   # 自動モードの切替
+            pass
+        else:
+            for stage in self.stages:   # 残りのキーはステージに任せる
+                if stage.on_key(key, self):
+                    break
+        return True
+
+    # カメラの切替が成功した時に呼ぶ．フラグを変えて，映像が切り替わるまでの少しの間は処理しない
+    def camera_switched(self, direction):
+        self.camera_dir = direction
+        self.settle_until = time.perf_counter() + self.camera_settle
+
+    # 取得時刻timestampのフレームがカメラの切替直後で，処理しないならTrue
+    def settling(self, timestamp):
+        return timestamp < self.settle_until
+
+    # 自動モードを使うステージがあるか
+    def uses_auto_mode(self):
+        return any(stage.uses_auto_mode for stage in self.stages)
+
+    # ループ部
+    def loop(self):
+        pre_time = time.time()      # 10秒ごとの'command'送信のための時刻変数
+
+        # Ctrl+cが押されるまでループ
+        try:
+            # 永久ループで繰り返す
+            while True:
+                # (1) 画像取得．前回と同じフレームは処理しないように，新しいフレームが来るまで待つ
+                start = time.perf_counter_ns()
+                frame = self.source.wait_next(timeout=0.1)
+                start = self.timer.lap('acquire', start)
+                if frame is not None and (self.settling(frame.timestamp) or self.scheduler.skip(frame.timestamp)):
+                    frame = None                    # カメラの切替直後や古すぎるフレームは処理しない
+
+                if frame is not None:
+                    if self.recorder is not None:   # 記録するなら画像とステータスをキューに入れる
+                        self.recorder.write_frame(frame, self.camera_dir)
+                        self.recorder.write_event('state', self.tello.get_current_state())
+
+                    # (2)(3) 画像サイズ変更・回転と画像処理
+                    ctx = self.process_frame(frame.image, frame.seq, frame.timestamp)
+                    start = time.perf_counter_ns()
+
+                    # (4) 表示するフレームの時だけ描画して，ウィンドウに表示
+                    if self.wants_overlay():
+                        self.render(ctx)
+                        start = self.timer.lap('overlay', start)
+                    self.backend.show(ctx.views)
+                    start = self.timer.lap('display', start)
+                    self.timer.frame_done()
+
+                # (5) キー入力を読む(OpenCVならウィンドウで1ms待つ)
+                key = self.backend.poll_key()
+                self.timer.lap('key', start)
+                if key != NO_KEY and self.recorder is not None:
+                    self.recorder.write_event('key', key)
+                if not self.handle_key(key):
+                    break
+
+                # (6) 10秒おきに'command'を送って、死活チェックを通す
+                current_time = time.time()                              # 現在時刻を取得
+                if current_time - pre_time > 10.0 :                     # 前回時刻から10秒以上経過しているか？
+                    self.tello.send_command_without_return('command')   # 'command'送信
+                    pre_time = current_time                             # 前回時刻を更新
+
+        except( KeyboardInterrupt, SystemExit):    # Ctrl+cが押されたらループ脱出
+            print( "Ctrl+c を検知" )
+
+    # ループ部(スレッド版)．取得・前処理と画像処理は別スレッドで動き，ここでは表示とキー入力だけを行う
+    def loop_threaded(self):
+        pre_time = time.time()      # 10秒ごとの'command'送信のための時刻変数
+        runner = ThreadedLoop(self).start()
+
+        try:
+            while True:
+                # 描画済みの画像があれば表示して，キー入力を読む
+                key = runner.poll()
+                if key != NO_KEY and self.recorder is not None:
+                    self.recorder.write_event('key', key)
+                if not self.handle_key(key):
+                    break
+
+                # 10秒おきに'command'を送って、死活チェックを通す
+                current_time = time.time()
+                if current_time - pre_time > 10.0 :
+                    self.tello.send_command_without_return('command')
+                    pre_time = current_time
+
+        except( KeyboardInterrupt, SystemExit):    # Ctrl+cが押されたらループ脱出
+            print( "Ctrl+c を検知" )
+
+        finally:
+            runner.stop()
+            print(runner.stats())                   # スレッド間で捨てたフレーム数を表示
+
+    # 終了処理部
+    def close(self):
+        for stage in self.stages:
+            stage.teardown(self)
+
+        self.commands.stop()                                    # コマンド送信スレッドを止める
+        self.rc.stop()                                          # rcコマンド送信スレッドを止める
+        print(self.rc.stats())                                  # rcコマンドの送信・削減数を表示
+
+        self.backend.close()                                    # すべてのOpenCVウィンドウを消去
+
+        if self.recorder is not None:                           # 記録を書き終えて索引を保存
+            self.recorder.stop()
+            print(self.recorder.stats())
+
+        # 段階ごとの処理時間を表示して，指定があればファイルに書き出す
+        if self.scheduler.enabled():
+            print(self.scheduler.stats())
+        self.timer.print_report()
+        if self.timings_file:
+            self.timer.dump(self.timings_file)
+
+        tello = self.tello
+        if self.sdk_ver == '30':                                # SDK 3.0に対応しているか？
+            tello.set_video_direction(Tello.CAMERA_FORWARD)     # カメラは前方に戻しておく
+
+        tello.streamoff()                                       # 画像転送を終了(熱暴走防止)
+        self.source.stop()                                      # フレーム監視スレッドを止める
+        print(self.source.stats())                              # フレームの受信・取りこぼし枚数を表示
+        self.frame_read.stop()                                  # 画像受信スレッドを止める
+
+        del tello.background_frame_read                         # フレーム受信のインスタンスを削除
+        self.tello = None                                       # telloインスタンスを削除
+
+    # 記録した映像を再生して，ステージの処理だけを行う(Telloには接続しない)
+    # realtime=Falseなら待たずに次々と処理して，最後にスループットを表示する
+    def replay(self, path, realtime=False):
+        self.set_cv_threads()
+        source = ReplaySource(path, realtime)
+        self.source = source
+        # rcコマンドは送らずに覚えるだけ．最大速度の再生ではフレームの古さは意味が無いので記録しない
+        self.rc = RcSender(None, rate=self.rc_rate, timer=self.timer if realtime else None)
+
+        self.backend.open()
+        for stage in self.stages:
+            stage.setup(self)
+
+        print('replay %s: %d frames' % (path, len(source)))
+        source.start()
+        start_time = time.perf_counter()
+        try:
+            while True:
+                start = time.perf_counter_ns()
+                frame = source.wait_next()
+                if frame is None:
+                    break
+                start = self.timer.lap('acquire', start)
+                if self.scheduler.skip(frame.timestamp):
+                    continue                        # 実時間の再生で古すぎるフレームは処理しない
+
+                self.camera_dir = source.camera_dir     # 記録した時のカメラの向きで回転する
+                ctx = self.process_frame(frame.image, frame.seq, frame.timestamp)
+                start = time.perf_counter_ns()
+                if self.wants_overlay():
+                    self.render(ctx)
+                    start = self.timer.lap('overlay', start)
+                self.backend.show(ctx.views)
+                start = self.timer.lap('display', start)
+                self.timer.frame_done()
+
+                # 記録中に押された自動モードの切替は同じフレームで再現する
+                for key in source.keys_at(frame.seq):
+                    self.handle_auto_key(key)
+
+                key = self.backend.poll_key()
+                self.timer.lap('key', start)
+                if key == 27:                       # ESCで再生を止める
+                    break
+                elif key == ord('p'):               # 段階ごとの処理時間をprintする
+                    self.timer.print_report()
+                elif not self.handle_auto_key(key):
+                    for stage in self.stages:       # トラックバーの保存などはステージに任せる
+                        if stage.on_key(key, self):
+                            break
+
+        except( KeyboardInterrupt, SystemExit):    # Ctrl+cが押されたらループ脱出
+            print( "Ctrl+c を検知" )
+
+        finally:
+            elapsed = time.perf_counter() - start_time
+            for stage in self.stages:
+                stage.teardown(self)
+            self.backend.close()
+
+            print('replayed %d frames in %.2f s, %.1f fps' % (source.consumed, elapsed,
+                                                            source.consumed / elapsed if elapsed > 0 else 0.0))
+            if self.scheduler.enabled():
+                print(self.scheduler.stats())
+            self.timer.print_report()
+            if self.timings_file:
+                self.timer.dump(self.timings_file)
+
+    # '1'/'0'キーによる自動モードの切替．処理したらTrueを返す
+    def handle_auto_key(self, key):
+        if key == ord('1') and self.uses_auto_mode():
+            self.auto_mode = 1                  # 追跡モードON
+        elif key == ord('0') and self.uses_auto_mode():
+            self.stop_rc()
+            self.auto_mode = 0                  # 追跡モードOFF
+        else:
+            return False
+        return True
+
+    # 接続からループ，終了処理までを通しで実行する
+    # 環境変数TELLO_REPLAYがあればTelloに接続せずに記録した映像を再生する
+    def run(self):
+        if self.replay_path:
+            path, _, mode = self.replay_path.partition(':')
+            self.replay(path, realtime=(mode == 'realtime'))
+            return
+
+        self.connect()
+        try:
+            if self.threaded:
+                self.loop_threaded()
+            else:
+                self.loop()
+        finally:
+            self.close()
+
+
+# 失敗したコマンドを表示する(Futureの完了コールバック)
+# コマンドが成功した時だけapplyを呼ぶ，Futureのdone-callbackを作る(取り消し・失敗の時は何もしない)
+def _on_success(apply):
+    def callback(future):
+        if not future.cancelled() and future.exception() is None:
+            apply()
+    return callback
+
+
+def _report_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        print('command failed: %s' % future.exception())
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from djitellopy import Tello    # カメラ方向の定数を使うため
+import cv2                      # OpenCVを使うため
+import numpy as np              # remap用の座標マップを作るため
+
+from .common import ensure_buffer
+
+
+# 960x720 -> 480x360 の縮小と，下方カメラの90度回転を行う前処理
+# 出力は毎回同じバッファに書き込むので，フレーム毎の配列確保が起きない
+class Preprocessor:
+    def __init__(self, size=(480, 360), interpolation=cv2.INTER_AREA):
+        self.size = size                    # 縮小後の画像サイズ(幅,高さ)
+        self.interpolation = interpolation  # INTER_AREA(きれい) か INTER_NEAREST(速い) など
+
+        self.small = None       # 縮小画像の出力バッファ
+        self.rotated = None     # 縮小+回転画像の出力バッファ
+        self.maps = None        # 縮小+回転を1回で行うremap用の座標マップ
+        self.map_key = None     # 座標マップを作った時の入力画像の形と補間方法
+
+    # 縮小と回転を1回のremapで行えるか(INTER_AREAはremapに無いので2段階で行う)
+    def can_fuse(self):
+        return self.interpolation in (cv2.INTER_NEAREST, cv2.INTER_LINEAR)
+
+    # 入力画像の形に合わせて，出力画素 -> 入力画素 の座標マップを作る
+    def build_maps(self, in_shape):
+        in_h, in_w = in_shape[:2]
+        out_w, out_h = self.size
+        sx = in_w / out_w       # 横方向の縮小率
+        sy = in_h / out_h       # 縦方向の縮小率
+
+        # 縮小画像上の座標 -> 入力画像上の座標
+        xs = np.arange(out_w, dtype=np.float32)
+        ys = np.arange(out_h, dtype=np.float32)
+        if self.interpolation == cv2.INTER_NEAREST:
+            src_x = xs * sx                     # resizeのINTER_NEARESTと同じ左上合わせ
+            src_y = ys * sy
+        else:
+            src_x = (xs + 0.5) * sx - 0.5       # resizeのINTER_LINEARと同じ画素中心合わせ
+            src_y = (ys + 0.5) * sy - 0.5
+
+        # 90度時計回り回転後の画像(高さout_w, 幅out_h)の(行r,列c)は，縮小画像の(行out_h-1-c, 列r)
+        map_x = np.repeat(src_x[:, np.newaxis], out_h, axis=1)             # 行rごとに縮小画像の列r
+        map_y = np.repeat(src_y[::-1][np.newaxis, :], out_w, axis=0)       # 列cごとに縮小画像の行out_h-1-c
+
+        # 固定小数点マップに変換しておくとremapが速い(INTER_NEARESTは小数部の表を作らない)
+        self.maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2,
+                                    nninterpolation=self.interpolation == cv2.INTER_NEAREST)
+        self.map_key = (in_shape, self.interpolation)
+
+    def __call__(self, image, camera_dir=Tello.CAMERA_FORWARD):
+        out_w, out_h = self.size
+
+        if camera_dir != Tello.CAMERA_DOWNWARD:
+            # 前方カメラは縮小だけ
+            self.small = ensure_buffer(self.small, (out_h, out_w) + image.shape[2:])
+            cv2.resize(image, self.size, dst=self.small, interpolation=self.interpolation)
+            return self.small
+
+        # 下向きカメラは画像の向きが90度ずれているので，90度回転して画像の上を前方にする
+        self.rotated = ensure_buffer(self.rotated, (out_w, out_h) + image.shape[2:])
+        if self.can_fuse():
+            # 縮小と回転を1回のremapで行う
+            if self.map_key != (image.shape, self.interpolation):
+                self.build_maps(image.shape)
+            cv2.remap(image, self.maps[0], self.maps[1], self.interpolation, dst=self.rotated)
+        else:
+            # 縮小してから回転する(どちらも出力バッファへ直接書き込む)
+            self.small = ensure_buffer(self.small, (out_h, out_w) + image.shape[2:])
+            cv2.resize(image, self.size, dst=self.small, interpolation=self.interpolation)
+            cv2.rotate(self.small, cv2.ROTATE_90_CLOCKWISE, dst=self.rotated)
+        return self.rotated
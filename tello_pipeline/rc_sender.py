@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import threading                # 一定周期で送信するスレッドを使うため
+import time                     # 送信周期を測るため
+
+
+# 自動モードのrcコマンドを一定周期で送るクラス
+# 毎フレームsend_rc_controlを呼ぶ代わりに最新の値だけを覚えておき，
+# rate[Hz]で値が変わった時と，refresh秒ごとの再送の時だけ実際に送信する
+# timerを渡すと，値の元になったフレームの古さ(取得からset/送信まで)を記録する
+# tello=Noneなら実際には送信しない(記録した映像の再生で使う)
+class RcSender:
+    def __init__(self, tello, rate=20.0, refresh=0.5, timer=None):
+        self.tello = tello
+        self.timer = timer          # StageTimer(Noneなら記録しない)
+        self.period = 1.0 / rate    # 送信周期[秒]
+        self.refresh = refresh      # 同じ値でもこの秒数ごとには送り直す
+
+        self.lock = threading.Lock()
+        self.target = None          # 次に送る値(a,b,c,d)．Noneなら何も送らない
+        self.frame_time = None      # targetの元になったフレームの取得時刻(time.perf_counter)
+        self.last_sent = None       # 最後に送った値
+        self.last_time = 0.0        # 最後に送った時刻
+
+        # 統計用のカウンタ
+        self.submitted = 0      # setが呼ばれた回数(以前なら毎回送信していた数)
+        self.sent = 0           # 実際に送信した回数
+        self.suppressed = 0     # 同じ値なので送らなかった周期の数
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # 送りたいrcの値を登録する(送信は送信スレッドが行う)
+    # frame_timeは値を計算するのに使ったフレームの取得時刻
+    def set(self, a, b, c, d, frame_time=None):
+        with self.lock:
+            self.target = (a, b, c, d)
+            self.frame_time = frame_time
+            self.submitted += 1
+        if frame_time is not None and self.timer is not None:
+            self.timer.record('rc_set_age', int((time.perf_counter() - frame_time) * 1e9))
+
+    # 停止(0,0,0,0)をすぐに送って，以後は何も送らない状態に戻す
+    def stop_motion(self):
+        with self.lock:
+            self.target = None
+            self.frame_time = None
+            self._send((0, 0, 0, 0), time.perf_counter())
+
+    # 実際の送信(呼び出し側はロックを持っていること)
+    def _send(self, value, now):
+        if self.tello is not None:
+            self.tello.send_rc_control(*value)
+        self.last_sent = value
+        self.last_time = now
+        self.sent += 1
+        # 送った値の元のフレームがどれだけ古いか(再送の時は古いフレームのまま送っていることが分かる)
+        if self.frame_time is not None and self.timer is not None:
+            self.timer.record('rc_send_age', int((time.perf_counter() - self.frame_time) * 1e9))
+
+    def _run(self):
+        next_time = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            with self.lock:
+                value = self.target
+                if value is not None:
+                    if value != self.last_sent or now - self.last_time >= self.refresh:
+                        self._send(value, now)
+                    else:
+                        self.suppressed += 1
+
+            # 処理が遅れても周期がずれていかないように，次の送信時刻を基準に待つ
+            next_time += self.period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.perf_counter()
+
+    # カウンタをまとめて返す．savedは以前の毎フレーム送信に比べて減らせたパケット数
+    def stats(self):
+        with self.lock:
+            return {'submitted': self.submitted, 'sent': self.sent,
+                    'suppressed': self.suppressed,
+                    'saved': max(self.submitted - self.sent, 0)}
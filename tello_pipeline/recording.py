@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# 飛行中の映像・ステータス・キー入力をディレクトリに保存して，あとで同じ順番で再生する
+#   frames.raw  : 受信した画像をそのまま(BGRの生データで)つなげたファイル
+#   index.npy   : 1フレーム1行の索引(通し番号，取得時刻，frames.rawでの位置，画像の形，カメラ方向)
+#   events.jsonl: ステータスとキー入力(どのフレームの時に起きたか付き)
+# frames.rawはnp.memmapでそのまま読めるので，再生時にデコードやコピーのコストが掛からない
+#
+# 環境変数TELLO_RECORD=ディレクトリ で記録，TELLO_REPLAY=ディレクトリ で再生(run()が切り替える)
+
+import json                     # イベントを1行ずつJSONで書くため
+import os                       # ディレクトリを作るため
+import queue                    # 書き込みスレッドへフレームを渡すため
+import threading                # ディスクへの書き込みをループと別のスレッドで行うため
+import time                     # 実時間で再生するため
+
+import numpy as np              # 索引とmemmapのため
+
+from .frame_source import Frame
+
+FRAMES_FILE = 'frames.raw'
+INDEX_FILE = 'index.npy'
+EVENTS_FILE = 'events.jsonl'
+
+# 索引の1行
+INDEX_DTYPE = np.dtype([('seq', np.int64), ('timestamp', np.float64), ('offset', np.int64),
+                        ('height', np.int32), ('width', np.int32), ('channels', np.int32),
+                        ('camera', np.int32)])
+
+
+# 映像とイベントを記録するクラス
+# ループからはキューに入れるだけで，ファイルへの書き込みは書き込みスレッドが行う
+# (キューが一杯ならそのフレームは記録せずにdroppedを数える)
+class FlightRecorder:
+    def __init__(self, path, max_queue=64):
+        self.path = path
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.index = []         # 索引の行(閉じる時にindex.npyへ書き出す)
+        self.offset = 0         # 次のフレームを書くframes.rawでの位置
+        self.written = 0        # 記録したフレーム数
+        self.dropped = 0        # 書き込みが追いつかずに記録しなかったフレーム数
+        self.seq = 0            # 最後にキューに入れたフレームの通し番号(イベントに付ける)
+        self.frames_file = None
+        self.events_file = None
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.frames_file = open(os.path.join(self.path, FRAMES_FILE), 'wb')
+        self.events_file = open(os.path.join(self.path, EVENTS_FILE), 'w')
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    # フレームを記録に回す(画像は受信スレッドが毎回新しく作るのでコピーしない)
+    def write_frame(self, frame, camera):
+        self.seq = frame.seq
+        try:
+            self.queue.put_nowait(('frame', frame, camera))
+        except queue.Full:
+            self.dropped += 1
+
+    # ステータスやキーなどのイベントを記録に回す
+    def write_event(self, kind, value):
+        event = {'type': kind, 'seq': self.seq, 'time': time.perf_counter(), 'value': value}
+        try:
+            self.queue.put_nowait(('event', event, None))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            kind, data, camera = item
+            if kind == 'frame':
+                image = np.ascontiguousarray(data.image)
+                self.frames_file.write(image.data)
+                height, width = image.shape[:2]
+                channels = image.shape[2] if image.ndim == 3 else 1
+                self.index.append((data.seq, data.timestamp, self.offset, height, width, channels, camera))
+                self.offset += image.nbytes
+                self.written += 1
+            else:
+                self.events_file.write(json.dumps(data) + '\n')
+
+    # 書き込みスレッドがキューを書き終えるのを待ってから，索引を書き出す
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.frames_file.close()
+        self.events_file.close()
+        np.save(os.path.join(self.path, INDEX_FILE), np.array(self.index, dtype=INDEX_DTYPE))
+
+    def stats(self):
+        return {'recorded': self.written, 'dropped': self.dropped}
+
+
+# 記録したフレームを順番に渡すクラス(FrameSourceと同じ使い方ができる)
+# realtime=Falseなら待たずに次々と，Trueなら記録した時と同じ間隔で渡す
+# 取得時刻は「再生開始時刻 + 記録開始からの経過時間」に置き換えるので，
+# 制御の時間差分(dt)は記録時と同じになる
+class ReplaySource:
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+        self.index = np.load(os.path.join(path, INDEX_FILE))
+        self.frames = np.memmap(os.path.join(path, FRAMES_FILE), dtype=np.uint8, mode='r')
+        self.events = load_events(path)
+        self.position = 0       # 次に渡すフレームの索引の行
+        self.start_time = None  # 再生を始めた時刻
+        self.camera_dir = None  # 最後に渡したフレームを記録した時のカメラ方向
+        self.consumed = 0       # 渡したフレーム数
+
+    def __len__(self):
+        return len(self.index)
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def stop(self):
+        pass
+
+    # 索引のi行目の画像(memmapの一部をそのまま見せる．コピーはしない)
+    def image(self, i):
+        row = self.index[i]
+        shape = (int(row['height']), int(row['width']), int(row['channels']))
+        size = shape[0] * shape[1] * shape[2]
+        image = self.frames[row['offset']:row['offset'] + size].reshape(shape)
+        return image if shape[2] > 1 else image[:, :, 0]
+
+    # 次のフレームを返す．最後まで渡し終えたらNoneを返す
+    def wait_next(self, timeout=None):
+        if self.position >= len(self.index):
+            return None
+        row = self.index[self.position]
+        timestamp = self.start_time + (row['timestamp'] - self.index[0]['timestamp'])
+        if self.realtime:
+            delay = timestamp - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        frame = Frame(int(row['seq']), timestamp, self.image(self.position))
+        self.camera_dir = int(row['camera'])
+        self.position += 1
+        self.consumed += 1
+        return frame
+
+    read = wait_next
+
+    # 通し番号seqのフレームの時に記録されたキー入力
+    def keys_at(self, seq):
+        return [event['value'] for event in self.events.get(seq, ()) if event['type'] == 'key']
+
+    def stats(self):
+        return {'frames': len(self.index), 'consumed': self.consumed}
+
+
+# events.jsonlを読んで，フレームの通し番号 -> そのフレームの時に起きたイベントのリスト にする
+def load_events(path):
+    events = {}
+    events_path = os.path.join(path, EVENTS_FILE)
+    if not os.path.exists(events_path):
+        return events
+    with open(events_path) as f:
+        for line in f:
+            event = json.loads(line)
+            events.setdefault(event['seq'], []).append(event)
+    return events
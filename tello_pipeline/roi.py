@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# 追跡対象の次の位置を予測して，探す範囲(ROI)を決めるクラス
+# 等速モデル(alpha-beta)で中心位置を予測し，前回のボックスを広げた範囲を返す．
+# 見失うたびにROIを広げ，max_misses回続けて見失ったら画面全体を探させる
+
+import time                     # 時刻が渡されない時に使うため
+
+
+class RoiPredictor:
+    def __init__(self, margin=0.5, min_pad=16, grow=1.5, max_misses=3, beta=0.5):
+        self.margin = margin            # ROIをボックスの何倍分広げるか
+        self.min_pad = min_pad          # ROIを広げる最小の画素数
+        self.grow = grow                # 1回見失うごとにROIを何倍に広げるか
+        self.max_misses = max_misses    # 何回続けて見失ったら画面全体を探すか
+        self.beta = beta                # 速度の更新ゲイン(0-1．大きいほど速度変化に素早く追従)
+        self.reset()
+
+    # 見失った状態に戻す
+    def reset(self):
+        self.box = None         # 最後に見つけたボックス(x,y,w,h)
+        self.center = None      # 最後に見つけた中心位置(cx,cy)
+        self.velocity = (0.0, 0.0)  # 中心位置の速度[px/秒]
+        self.time = None        # 最後に見つけた時刻
+        self.misses = 0         # 続けて見失った回数
+
+    def locked(self):
+        return self.box is not None
+
+    # 時刻tでの中心位置の予測
+    def predict(self, t=None):
+        if t is None:
+            t = time.perf_counter()
+        dt = t - self.time
+        return (self.center[0] + self.velocity[0] * dt, self.center[1] + self.velocity[1] * dt)
+
+    # 時刻tに探すべきROI(x0,y0,x1,y1)を返す．見失っていればNone(画面全体を探す)
+    def roi(self, shape, t=None):
+        if self.box is None:
+            return None
+        cx, cy = self.predict(t)
+        _, _, w, h = self.box
+        expand = self.grow ** self.misses
+        half_w = w / 2 + max(w * self.margin, self.min_pad) * expand
+        half_h = h / 2 + max(h * self.margin, self.min_pad) * expand
+        x0 = max(int(cx - half_w), 0)
+        y0 = max(int(cy - half_h), 0)
+        x1 = min(int(cx + half_w) + 1, shape[1])
+        y1 = min(int(cy + half_h) + 1, shape[0])
+        if x1 <= x0 or y1 <= y0:    # 予測が画面外に出たら画面全体を探す
+            return None
+        return x0, y0, x1, y1
+
+    # 時刻tに見つけたボックスで位置と速度を更新する
+    def hit(self, box, t=None):
+        if t is None:
+            t = time.perf_counter()
+        x, y, w, h = box
+        center = (x + w / 2, y + h / 2)
+        if self.center is not None and t > self.time:
+            # 予測とのずれの分だけ速度を修正する
+            predicted = self.predict(t)
+            dt = t - self.time
+            vx = self.velocity[0] + self.beta * (center[0] - predicted[0]) / dt
+            vy = self.velocity[1] + self.beta * (center[1] - predicted[1]) / dt
+            self.velocity = (vx, vy)
+        self.box = tuple(box)
+        self.center = center
+        self.time = t
+        self.misses = 0
+
+    # 見失った時に呼ぶ．max_misses回を超えたら見失った状態に戻す
+    def miss(self):
+        self.misses += 1
+        if self.misses > self.max_misses:
+            self.reset()
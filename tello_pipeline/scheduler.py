@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# フレームごとに処理の締め切り(取得時刻 + budget秒)を決めて，間に合わない時は
+# 後回しにできる処理を減らすスケジューラ
+#   古すぎるフレーム(取得からmax_age秒以上)は処理せずに捨てる
+#   締め切りを過ぎたフレームは描画しない
+#   負荷が高い間(degraded)は2値画像などの副ウィンドウを出さず，画面全体の探索を後回しにし，
+#   顔検出の間隔を広げる．負荷が下がったら元に戻す
+# budget=Noneなら何もしない(今まで通り全部処理する)
+
+import time                     # 処理時間を測るため
+
+
+class FrameScheduler:
+    def __init__(self, budget=None, max_age=None, high=0.9, low=0.6, alpha=0.2):
+        self.budget = budget        # 1フレームの処理に使える時間[秒](30fpsなら1/30)
+        self.max_age = max_age if max_age is not None else (2 * budget if budget else None)    # これより古いフレームは捨てる[秒]
+        self.high = high            # 負荷がこれを超えたらdegradedにする
+        self.low = low              # 負荷がこれを下回ったらdegradedをやめる
+        self.alpha = alpha          # 負荷の指数移動平均の係数
+
+        self.load = 0.0             # 処理にかかった時間 / budget の移動平均
+        self.degraded = False       # 後回しにできる処理を減らしているか
+        self.start = None           # 今のフレームの処理を始めた時刻
+        self.timestamp = None       # 今のフレームの取得時刻
+        self.deadline = None        # 今のフレームの締め切り
+
+        # 統計用のカウンタ
+        self.frames = 0             # 処理したフレーム数
+        self.skipped = 0            # 古すぎて捨てたフレーム数
+        self.degraded_frames = 0    # degradedで処理したフレーム数
+        self.late = 0               # 締め切りまでに処理が終わらなかったフレーム数
+        self.overlays_skipped = 0   # 締め切りを過ぎていて描画しなかったフレーム数
+
+    def enabled(self):
+        return self.budget is not None
+
+    # 取得時刻timestampのフレームを処理せずに捨てるか
+    def skip(self, timestamp):
+        if not self.enabled() or timestamp is None:
+            return False
+        if time.perf_counter() - timestamp > self.max_age:
+            self.skipped += 1
+            return True
+        return False
+
+    # フレームの処理を始める．degradedならTrueを返す
+    def begin(self, timestamp=None):
+        if not self.enabled():
+            return False
+        self.start = time.perf_counter()
+        self.timestamp = timestamp if timestamp is not None else self.start
+        self.deadline = self.timestamp + self.budget
+        self.frames += 1
+        if self.degraded:
+            self.degraded_frames += 1
+        return self.degraded
+
+    # フレームの処理(ステージの実行)が終わった時に呼んで，負荷を更新する
+    # 負荷は処理時間とフレームの古さの大きい方で測る(前の段階で待たされた分も入れるため)
+    def end(self):
+        if not self.enabled() or self.start is None:
+            return
+        now = time.perf_counter()
+        used = max(now - self.start, now - self.timestamp)
+        self.load += self.alpha * (used / self.budget - self.load)
+        if now > self.deadline:
+            self.late += 1
+
+        # 行ったり来たりしないように，上げる閾値と下げる閾値を分けておく
+        if self.degraded and self.load < self.low:
+            self.degraded = False
+        elif not self.degraded and self.load > self.high:
+            self.degraded = True
+
+    # 締め切りを過ぎていて描画を省くならTrue
+    def shed_overlay(self):
+        if not self.enabled() or self.deadline is None or time.perf_counter() <= self.deadline:
+            return False
+        self.overlays_skipped += 1
+        return True
+
+    # 負荷に合わせて間隔(何フレームに1回の重い処理か)を1ずつ広げたり狭めたりする
+    def adapt_interval(self, interval, lo, hi):
+        if not self.enabled():
+            return interval
+        if self.degraded:
+            return min(interval + 1, hi)
+        if self.load < self.low:
+            return max(interval - 1, lo)
+        return interval
+
+    def stats(self):
+        return {'frames': self.frames, 'skipped': self.skipped, 'degraded': self.degraded_frames,
+                'late': self.late, 'overlays_skipped': self.overlays_skipped, 'load': round(float(self.load), 2)}
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+# 実機の代わりにTello SDKのテキストプロトコルを話すUDPシミュレータ
+#
+#   python3 -m tello_pipeline.simulator --bind 192.168.10.1 --video clip.h264
+#
+# コマンド(8889)に応答し，状態(8890)を10Hzで送り，streamon中は映像(11111)を送る．
+# 録画したH.264(Annex B形式の.h264/.264)はそのまま，それ以外の動画はPyAVで
+# 再エンコードして送る．--videoを省略するとPyAVで合成映像を作る．
+#
+# djitellopyはクライアント側でもUDP 8889番をワイルドカードでbindするので，
+# 同じマシンで動かす時はシミュレータを別のネットワーク名前空間に置き，
+# 環境変数TELLO_HOSTでそのアドレスをパイプラインに渡す．例:
+#
+#   sudo ip netns add tello
+#   sudo ip link add veth0 type veth peer name veth1 netns tello
+#   sudo ip addr add 192.168.10.2/24 dev veth0 && sudo ip link set veth0 up
+#   sudo ip netns exec tello ip addr add 192.168.10.1/24 dev veth1
+#   sudo ip netns exec tello ip link set veth1 up
+#   sudo ip netns exec tello python3 -m tello_pipeline.simulator --bind 192.168.10.1
+
+import argparse                 # コマンドライン引数を読むため
+import random                   # パケットロスを真似るため
+import socket                   # UDP通信のため
+import threading                # コマンド・状態・映像を並行して扱うため
+import time                     # 遅延と送信周期のため
+
+import numpy as np              # 合成映像を作るため
+
+CONTROL_PORT = 8889     # コマンドの待受ポート
+STATE_PORT = 8890       # クライアントが状態を受けるポート
+VIDEO_PORT = 11111      # クライアントが映像を受けるポート
+PACKET_SIZE = 1460      # 映像パケットの最大サイズ(実機と同じ)
+
+
+# H.264のバイト列をNALユニット(スタートコード込み)に分ける
+def split_nal_units(data):
+    starts = []
+    i = data.find(b'\x00\x00\x01')
+    while i >= 0:
+        # 4バイトのスタートコード(00 00 00 01)なら先頭の0も含める
+        starts.append(i - 1 if i > 0 and data[i-1] == 0 else i)
+        i = data.find(b'\x00\x00\x01', i + 3)
+    starts.append(len(data))
+    return [data[starts[k]:starts[k+1]] for k in range(len(starts) - 1)]
+
+
+# NALユニットをフレーム単位(スライスで終わる単位)にまとめる
+def group_frames(nal_units):
+    frames, current = [], []
+    for nal in nal_units:
+        current.append(nal)
+        offset = 4 if nal[2] == 0 else 3
+        nal_type = nal[offset] & 0x1F
+        if nal_type in (1, 5):      # 非IDR/IDRスライスで1フレーム分
+            frames.append(b''.join(current))
+            current = []
+    if current:
+        frames.append(b''.join(current))
+    return frames
+
+
+# 録画済みの生H.264ファイルを読み込んでフレーム単位のバイト列にする
+def load_h264(path):
+    with open(path, 'rb') as f:
+        return group_frames(split_nal_units(f.read()))
+
+
+# PyAVで映像をH.264にエンコードしてフレーム単位のバイト列にする
+# sourceがNoneなら，画面を横切る色付きの四角の合成映像を作る
+def encode_h264(source=None, num_frames=300, size=(960, 720), fps=30):
+    import av               # 合成映像・再エンコードの時だけ必要なのでここでimport
+
+    codec = av.CodecContext.create('h264', 'w')
+    codec.width, codec.height = size
+    codec.pix_fmt = 'yuv420p'
+    codec.framerate = fps
+    codec.options = {'tune': 'zerolatency', 'preset': 'ultrafast', 'g': str(fps)}
+
+    if source is None:
+        images = _synthetic_images(num_frames, size)
+    else:
+        container = av.open(source)
+        images = (f.to_ndarray(format='bgr24') for f in container.decode(video=0))
+
+    frames = []
+    for image in images:
+        frame = av.VideoFrame.from_ndarray(image, format='bgr24').reformat(width=size[0], height=size[1])
+        frames.extend(bytes(p) for p in codec.encode(frame))
+    frames.extend(bytes(p) for p in codec.encode(None))
+    return frames
+
+
+# 灰色の背景を赤い四角が往復する合成映像
+def _synthetic_images(num_frames, size):
+    w, h = size
+    image = np.empty((h, w, 3), dtype=np.uint8)
+    for n in range(num_frames):
+        image[:] = 96
+        x = int((w - 120) * (0.5 + 0.5 * np.sin(2 * np.pi * n / num_frames)))
+        image[h//2-60:h//2+60, x:x+120] = (0, 0, 255)
+        yield image
+
+
+# Tello 1台分のシミュレータ
+class TelloSimulator:
+    def __init__(self, bind='127.0.0.1', video=None, fps=30.0, latency=0.0, loss=0.0, motion_time=1.0):
+        self.bind = bind                # コマンドを受けるアドレス(クライアントはこれをhostに指定する)
+        self.fps = fps                  # 映像のフレームレート
+        self.latency = latency          # コマンド応答の遅延[秒]
+        self.loss = loss                # コマンド・応答・映像パケットを捨てる確率
+        self.motion_time = motion_time  # 移動・旋回コマンドが完了するまでの時間[秒]
+
+        # 映像のフレーム(バイト列)．録画ファイルか合成映像
+        if video is None:
+            self.frames = encode_h264()
+        elif video.endswith(('.h264', '.264')):
+            self.frames = load_h264(video)
+        else:
+            self.frames = encode_h264(video)
+
+        self.client = None          # 最後にコマンドを送ってきたクライアントのアドレス
+        self.streaming = False      # streamon中か
+        self.state = {'h': 0, 'yaw': 0, 'bat': 87}
+        self.received = 0           # 受け取ったコマンド数
+        self.rc_count = 0           # 受け取ったrcコマンド数
+
+        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.command_socket.bind((bind, CONTROL_PORT))
+        self.command_socket.settimeout(0.5)
+        self.state_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.state_socket.bind((bind, 0))
+        self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.video_socket.bind((bind, 0))
+
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        for target in (self._command_loop, self._state_loop, self._video_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        for sock in (self.command_socket, self.state_socket, self.video_socket):
+            sock.close()
+
+    def _lost(self):
+        return self.loss > 0 and random.random() < self.loss
+
+    # コマンドを受けて応答する
+    def _command_loop(self):
+        while self.running:
+            try:
+                data, address = self.command_socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            if self._lost():
+                continue
+            self.client = address
+            self.received += 1
+            command = data.decode('utf-8', errors='replace').strip()
+            response = self.respond(command)
+            if response is None:
+                continue
+            # 応答は遅延させて別スレッドから返す(受信は止めない)
+            threading.Thread(target=self._reply, args=(response, address, self.delay(command)), daemon=True).start()
+
+    def _reply(self, response, address, delay):
+        time.sleep(delay)
+        if not self._lost() and self.running:
+            self.command_socket.sendto(response.encode('utf-8'), address)
+
+    # コマンドの種類に応じた応答までの時間
+    def delay(self, command):
+        name = command.split(' ')[0]
+        if name in ('takeoff', 'land', 'up', 'down', 'left', 'right', 'forward', 'back', 'cw', 'ccw'):
+            return self.latency + self.motion_time
+        return self.latency
+
+    # コマンドに対する応答文字列を返す．応答しないコマンドはNone
+    def respond(self, command):
+        words = command.split(' ')
+        name = words[0]
+        if name == 'rc':
+            self.rc_count += 1
+            return None
+        if name == 'streamon':
+            self.streaming = True
+        elif name == 'streamoff':
+            self.streaming = False
+        elif name == 'takeoff':
+            self.state['h'] = 80
+        elif name == 'land':
+            self.state['h'] = 0
+        elif name in ('up', 'down') and len(words) > 1:
+            self.state['h'] += int(words[1]) * (1 if name == 'up' else -1)
+        elif name in ('cw', 'ccw') and len(words) > 1:
+            self.state['yaw'] = (self.state['yaw'] + int(words[1]) * (1 if name == 'cw' else -1) + 180) % 360 - 180
+        elif name == 'sdk?':
+            return '30'
+        elif name == 'battery?':
+            return str(self.state['bat'])
+        elif name == 'sn?':
+            return 'SIMULATOR000'
+        elif name.endswith('?'):
+            return '0'
+        return 'ok'
+
+    # 状態を10Hzで送る
+    def _state_loop(self):
+        while self.running:
+            if self.client is not None and not self._lost():
+                state = ('mid:-1;x:0;y:0;z:0;mpry:0,0,0;pitch:0;roll:0;yaw:%d;vgx:0;vgy:0;vgz:0;'
+                         'templ:60;temph:62;tof:%d;h:%d;bat:%d;baro:0.00;time:0;agx:0.00;agy:0.00;agz:-1000.00;\r\n'
+                         % (self.state['yaw'], self.state['h'] + 10, self.state['h'], self.state['bat']))
+                self.state_socket.sendto(state.encode('utf-8'), (self.client[0], STATE_PORT))
+            time.sleep(0.1)
+
+    # streamon中は映像をフレームレートに合わせて送る
+    def _video_loop(self):
+        index = 0
+        next_time = time.perf_counter()
+        while self.running:
+            if self.streaming and self.client is not None and self.frames:
+                frame = self.frames[index % len(self.frames)]
+                index += 1
+                for offset in range(0, len(frame), PACKET_SIZE):
+                    if not self._lost():
+                        self.video_socket.sendto(frame[offset:offset+PACKET_SIZE], (self.client[0], VIDEO_PORT))
+            next_time += 1.0 / self.fps
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.perf_counter()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tello SDK simulator')
+    parser.add_argument('--bind', default='127.0.0.1', help='address to answer commands on')
+    parser.add_argument('--video', default=None, help='raw .h264 to replay, or any video PyAV can decode')
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--latency', type=float, default=0.0, help='command response delay [s]')
+    parser.add_argument('--loss', type=float, default=0.0, help='packet loss probability (0-1)')
+    parser.add_argument('--motion-time', type=float, default=1.0, help='time taken by move/rotate commands [s]')
+    args = parser.parse_args()
+
+    simulator = TelloSimulator(args.bind, args.video, args.fps, args.latency, args.loss, args.motion_time).start()
+    print('Tello simulator on %s:%d (%d video frames)' % (args.bind, CONTROL_PORT, len(simulator.frames)))
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    simulator.stop()
+    print('commands=%d rc=%d' % (simulator.received, simulator.rc_count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,666 @@
+# -*- coding: utf-8 -*-
+
+import os                       # パラメータファイルの有無を調べるため
+
+import cv2                      # OpenCVを使うため
+import numpy as np              # ラベリングにNumPyが必要なので
+
+from .common import MAIN_WINDOW, BINARY_WINDOW, ensure_buffer
+from .params import ThresholdParams
+from .lut import in_hsv_range, build_hsv_lut, LutClassifier
+from .blob import LargestBlobTracker, ClassBlobFinder
+from .roi import RoiPredictor
+from .face import FaceDetector, TemplateTracker, FaceDetectWorker
+from .controller import PidController
+from .camshift import CamShiftTracker
+
+
+# ステージの基底クラス．必要なメソッドだけ上書きして使う
+class Stage:
+    uses_auto_mode = False      # '1'/'0'キーの自動モード切替を使うステージはTrueにする
+
+    # ループ開始前に1回だけ呼ばれる(トラックバー作成など)
+    def setup(self, pipeline):
+        pass
+
+    # 入力画像の形が決まった・変わった時に呼ばれる．ここで出力バッファを確保しておく
+    def allocate(self, shape):
+        pass
+
+    # 毎フレーム呼ばれる画像処理本体(制御に必要な処理だけを行う)
+    def process(self, ctx, pipeline):
+        pass
+
+    # 表示するフレームの時だけ呼ばれる描画処理(枠や文字を描き，ctx.showで表示画像を登録する)
+    def overlay(self, ctx, pipeline):
+        pass
+
+    # パイプラインが処理しなかったキーを受け取る．処理したらTrueを返す
+    def on_key(self, key, pipeline):
+        return False
+
+    # 終了時に1回だけ呼ばれる
+    def teardown(self, pipeline):
+        pass
+
+
+# inRangeによる範囲指定2値化ステージの共通部分
+# params_fileがあればそこから上下限を読み込み，'o'キーでそこへ保存する
+# (省略時は環境変数TELLO_PARAMS)．ファイルから読んだ時はトラックバーを作らない
+class _ThresholdStage(Stage):
+    channels = ()       # トラックバー名の接頭辞と最大値の組
+
+    def __init__(self, params_file=None):
+        self.params = ThresholdParams(self.channels)    # 2値化の上下限
+        self.params_file = params_file if params_file is not None else os.environ.get('TELLO_PARAMS')
+        self.mask = None        # 2値画像の出力バッファ
+        self.result = None      # マスク適用画像の出力バッファ(表示する時だけ作る)
+        self.source = None      # 2値化した画像(BGRかHSV)
+
+    def setup(self, pipeline):
+        if self.params_file and os.path.exists(self.params_file):
+            self.params.load(self.params_file)      # 保存済みの値を使うのでGUIは不要
+            print('loaded %s: %s' % (self.params_file, self.params.values()))
+        elif pipeline.backend.has_window:
+            self.params.create_trackbars()          # トラックバーの生成
+
+    def on_key(self, key, pipeline):
+        if key == ord('o'):             # 今の上下限をファイルに保存
+            path = self.params_file or 'threshold_params.json'
+            self.params.save(path)
+            print('saved %s' % path)
+            return True
+        return False
+
+    def allocate(self, shape):
+        self.mask = ensure_buffer(self.mask, shape[:2])
+        self.result = ensure_buffer(self.result, shape)
+
+    # 2値化に使う画像を返す(BGRならそのまま，HSVなら変換する)
+    def convert(self, ctx):
+        return ctx.image
+
+    # 範囲指定2値化してself.maskに書き込む
+    def threshold(self, src):
+        # inRange関数で範囲指定２値化(上下限はトラックバーのコールバックで更新済み)
+        cv2.inRange(src, self.params.lower, self.params.upper, dst=self.mask)
+
+    def process(self, ctx, pipeline):
+        self.source = self.convert(ctx)
+        self.threshold(self.source)
+        ctx.mask = self.mask
+
+    def overlay(self, ctx, pipeline):
+        src = self.source
+
+        # bitwise_andで元画像にマスクをかける -> マスクされた部分の色だけ残る
+        self.result.fill(0)     # dst指定時はマスク外が書き換わらないので先に消しておく
+        cv2.bitwise_and(src, src, dst=self.result, mask=self.mask)
+
+        ctx.result = self.result
+        ctx.show(MAIN_WINDOW, self.result)
+        ctx.show(BINARY_WINDOW, self.mask)
+
+
+# BGRの範囲指定2値化(step02)
+class BgrThresholdStage(_ThresholdStage):
+    channels = (("B", 255), ("G", 255), ("R", 255))     # BGR画像なのでBGR並び
+
+
+# HSVの範囲指定2値化(step03以降)
+class HsvThresholdStage(_ThresholdStage):
+    channels = (("H", 179), ("S", 255), ("V", 255))     # Hueの最大値は179
+
+    def __init__(self, params_file=None):
+        super().__init__(params_file)
+        self.hsv = None         # HSV画像の出力バッファ
+
+    def allocate(self, shape):
+        super().allocate(shape)
+        self.hsv = ensure_buffer(self.hsv, shape)
+
+    def convert(self, ctx):
+        cv2.cvtColor(ctx.image, cv2.COLOR_BGR2HSV, dst=self.hsv)   # BGR画像 -> HSV画像
+        ctx.hsv = self.hsv
+        return self.hsv
+
+    def threshold(self, src):
+        # H_min > H_max なら0/179をまたぐHueの範囲(赤など)として扱う
+        in_hsv_range(src, self.params.lower, self.params.upper, dst=self.mask)
+
+
+# HSV変換をせずに，BGR値 -> 2値 の表を引いてHSVの範囲指定2値化をするステージ
+# 表は上下限が変わった時だけ作り直す．bits=5は32x32x32に量子化した表(境界付近の色は
+# 誤差が出る)，bits=8は256^3の完全な表(16MB)
+class HsvLutThresholdStage(HsvThresholdStage):
+    def __init__(self, params_file=None, bits=5):
+        super().__init__(params_file)
+        self.classifier = LutClassifier(bits)
+        self.lut = None             # BGR値 -> 2値 の表
+        self.lut_version = -1       # 表を作った時の上下限のバージョン
+
+    def convert(self, ctx):
+        return ctx.image    # HSV画像は作らない(表示用のマスク適用画像もBGRになる)
+
+    def threshold(self, src):
+        if self.lut_version != self.params.version:
+            self.lut = build_hsv_lut([(self.params.lower, self.params.upper)], self.classifier.bits)
+            self.lut_version = self.params.version
+        self.classifier.apply(src, self.lut, self.mask)
+
+
+# 複数の色を1回で分類して，色ごとの面積最大のラベルを求めるステージ
+# colorsは 色の名前 -> (HSVの下限, 上限) の辞書(H_min > H_maxなら0/179をまたぐ範囲．後の色が優先)
+# 全色分の範囲から BGR値 -> クラス番号 の表を1つ作っておくので，毎フレームの分類とラベリングは
+# 色の数によらず1回ずつで済む
+class MultiColorStage(Stage):
+    def __init__(self, colors, bits=5, min_area=20):
+        self.names = list(colors)
+        ranges = [tuple(np.array(bound, dtype=np.uint8) for bound in colors[name]) for name in self.names]
+        self.lut = build_hsv_lut(ranges, bits, values=range(1, len(ranges) + 1))
+        self.classifier = LutClassifier(bits)
+        self.finder = ClassBlobFinder(len(ranges), min_area)
+        self.classes = None     # クラス番号画像の出力バッファ
+        self.view = None        # クラス番号を色で塗った表示用画像の出力バッファ
+
+        # 描画に使う色(背景は黒，各クラスは範囲の真ん中のHueの鮮やかな色)
+        hues = [(int(lower[0]) + int(upper[0]) + (180 if lower[0] > upper[0] else 0)) // 2 % 180
+                for lower, upper in ranges]
+        hsv = np.array([[(h, 255, 255) for h in hues]], dtype=np.uint8)
+        self.palette = np.vstack([np.zeros((1, 3), dtype=np.uint8), cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0]])
+
+    def allocate(self, shape):
+        self.classes = ensure_buffer(self.classes, shape[:2])
+        self.view = ensure_buffer(self.view, shape)
+
+    def process(self, ctx, pipeline):
+        # 表を引いて全画素を一度に分類し，1回のラベリングで色ごとの面積最大のラベルを求める
+        self.classifier.apply(ctx.image, self.lut, self.classes)
+        blobs = self.finder.find(self.classes)
+        ctx.classes = self.classes
+        ctx.mask = self.finder.mask     # どれかの色に入った画素(色の境目は除く)
+        ctx.blobs = dict(zip(self.names, blobs))
+
+    def overlay(self, ctx, pipeline):
+        image = ctx.image
+        for index, name in enumerate(self.names):
+            blob = ctx.blobs[name]
+            if blob is None:
+                continue
+            color = tuple(int(v) for v in self.palette[index + 1])
+            cv2.rectangle(image, (blob.x, blob.y), (blob.x+blob.w, blob.y+blob.h), color, 2)
+            cv2.putText(image, "%s %d"%(name, blob.area), (blob.x, blob.y-5), cv2.FONT_HERSHEY_PLAIN, 1, color)
+        ctx.show(MAIN_WINDOW, image)
+        np.take(self.palette, self.classes, axis=0, out=self.view)     # クラス番号を色で塗る
+        ctx.show(BINARY_WINDOW, self.view)
+
+
+# ラベルを囲うバウンディングボックスと，重心位置の座標と面積を描く
+def draw_label(image, x, y, w, h, s, mx, my):
+    cv2.rectangle(image, (x, y), (x+w, y+h), (255, 0, 255))
+    cv2.putText(image, "%d,%d"%(mx,my), (x-15, y+h+15), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0))
+    cv2.putText(image, "%d"%(s), (x, y+h+30), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0))
+
+
+# 複数のラベルの枠と重心・面積をまとめて描く
+# 枠は1回のpolylinesで描き，文字はラベルの数だけputTextする(ラベルの数はtop_kで抑えておく)
+def draw_labels(image, stats, center):
+    if len(stats) == 0:
+        return
+    x, y, w, h = stats[:, 0], stats[:, 1], stats[:, 2], stats[:, 3]
+    corners = np.stack([np.stack([x, y], axis=1), np.stack([x+w, y], axis=1),
+                        np.stack([x+w, y+h], axis=1), np.stack([x, y+h], axis=1)], axis=1)
+    cv2.polylines(image, corners.astype(np.int32), True, (255, 0, 255))
+
+    # NumPyの要素のままだと1個ずつの変換が遅いので，先にPythonのintのリストにしておく
+    for (x, y, w, h, s), (mx, my) in zip(stats.tolist(), center.astype(np.int32).tolist()):
+        cv2.putText(image, "%d,%d"%(mx,my), (x-15, y+h+15), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0))
+        cv2.putText(image, "%d"%(s), (x, y+h+30), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0))
+
+
+# ラベルに枠と重心・面積を描くラベリングステージ(step04)
+# ノイズの多い2値画像でもラベルの数だけ処理が重くならないように，面積min_area未満と
+# 縦横比がmax_aspectを超えるラベルを捨て，面積の大きい順にtop_k個だけを描く(すべてNumPyでまとめて行う)
+class LabelingStage(Stage):
+    def __init__(self, min_area=1, max_aspect=None, top_k=100):
+        self.min_area = min_area        # これより小さいラベルは描かない
+        self.max_aspect = max_aspect    # 縦横比(長い辺/短い辺)がこれより大きいラベルは描かない(Noneなら見ない)
+        self.top_k = top_k              # 面積の大きい順に何個まで描くか(Noneなら全部)
+        self.total = 0                  # 最後のフレームのラベル数(背景を除く)
+
+    # 条件に合うラベルを面積の大きい順にtop_k個選んで，(stats, center)を返す
+    def select(self, stats, center):
+        area = stats[:, cv2.CC_STAT_AREA]
+        keep = area >= self.min_area
+        if self.max_aspect is not None:
+            w = stats[:, cv2.CC_STAT_WIDTH]
+            h = stats[:, cv2.CC_STAT_HEIGHT]
+            keep &= np.maximum(w, h) <= self.max_aspect * np.minimum(w, h)
+        index = np.flatnonzero(keep)
+
+        # 全部並べ替えずに，上位top_k個だけを取り出してから並べる
+        if self.top_k is not None and len(index) > self.top_k:
+            index = index[np.argpartition(area[index], -self.top_k)[-self.top_k:]]
+        index = index[np.argsort(area[index])[::-1]]
+        return stats[index], center[index]
+
+    def process(self, ctx, pipeline):
+        # 面積・重心計算付きのラベリング処理を行う
+        num_labels, label_image, stats, center = cv2.connectedComponentsWithStats(ctx.mask)
+        self.total = num_labels - 1
+
+        # 先頭のラベルは画面全体を覆う黒なので不要．スライスで除いてから選ぶ
+        ctx.labels = self.select(stats[1:], center[1:])
+
+    def overlay(self, ctx, pipeline):
+        stats, center = ctx.labels
+        draw_labels(ctx.result, stats, center)
+
+
+# 面積最大のラベルを画面中央に捉えるように旋回する色追跡ステージ(step05)
+class ColorTrackingStage(Stage):
+    uses_auto_mode = True
+
+    def __init__(self, scale=1, controller=None):
+        # 旋回方向だけのP制御(ゲインは低めの0.3，±20未満は不感帯)．PIDにしたければcontrollerを渡す
+        self.controller = controller if controller is not None else PidController(kp=(0, 0, 0, 0.3), deadband=(0, 0, 0, 20))
+        self.tracker = LargestBlobTracker(scale=scale)  # 前回位置の周りだけを探す面積最大ラベルの追跡
+
+    def process(self, ctx, pipeline):
+        # 面積最大のラベルを探す(見つけている間は予測位置の周りだけを探す)
+        # 処理が遅れている間は画面全体の探索を後回しにする
+        blob = self.tracker.update(ctx.mask, ctx.timestamp, full=not ctx.degraded)
+        if blob is None:
+            self.controller.reset()     # 見失ったら積分・微分をやり直す
+            if pipeline.auto_mode == 1:
+                pipeline.send_rc(0, 0, 0, 0)    # 見失った時はその場で止まる(最後のrcを送り続けないように)
+            return
+
+        # 面積最大のラベルのx,y,w,h,面積s,重心位置mx,myを得る
+        mx = int(blob.cx)
+        ctx.target = blob.box()
+        ctx.blob = blob
+
+        if pipeline.auto_mode == 1:
+            # 画面中心との差分(右にずれていたら正)から旋回量を計算する
+            error = (0.0, 0.0, 0.0, mx - ctx.image.shape[1]/2)
+            a, b, c, d = self.controller.update(error, ctx.timestamp)
+
+            print('dx=%f'%(error[3]) )
+            pipeline.send_rc( int(a), int(b), int(c), int(d) )
+
+    def overlay(self, ctx, pipeline):
+        blob = ctx.blob
+        if blob is None:
+            return
+        draw_label(ctx.result, blob.x, blob.y, blob.w, blob.h, blob.area, int(blob.cx), int(blob.cy))
+
+    def teardown(self, pipeline):
+        print(self.tracker.stats())     # ROIだけで見つかった回数と画面全体を探した回数
+
+
+# 色追跡ステージの代わりに使える，ヒストグラムの逆投影とCamShiftによる色追跡ステージ(step05)
+# 最初(と見失った時)だけ画面全体を2値化・ラベリングして面積最大のラベルの色を覚え，
+# 後は前回の位置の周りだけで逆投影とCamShiftを行うので，毎フレームの処理が軽い．
+# 'h'キーで今のラベルから色を覚え直し，'g'キーでウィンドウ上で選んだ範囲の色を覚える
+class CamShiftTrackingStage(HsvThresholdStage):
+    uses_auto_mode = True
+
+    def __init__(self, params_file=None, controller=None, tracker=None):
+        super().__init__(params_file)
+        # 旋回方向だけのP制御(ColorTrackingStageと同じ)．PIDにしたければcontrollerを渡す
+        self.controller = controller if controller is not None else PidController(kp=(0, 0, 0, 0.3), deadband=(0, 0, 0, 20))
+        self.tracker = tracker if tracker is not None else CamShiftTracker()
+        self.blobs = LargestBlobTracker()   # 色を覚えるための面積最大のラベル探し
+        self.tracking = False   # このフレームをCamShiftで追跡できたか
+        self.box = None         # 追跡対象のx,y,w,h
+        self.image = None       # 範囲選択の時に表示する最後のフレーム(描画済み．色は覚えない)
+        self.selected = None    # ウィンドウで選んだ範囲(x,y,w,h)．次のフレームの描画前の画像で色を覚える
+        self.back = None        # 逆投影の表示用画像の出力バッファ
+
+        # 統計用のカウンタ
+        self.tracked = 0        # CamShiftで追跡したフレーム数
+        self.thresholded = 0    # 画面全体を2値化・ラベリングしたフレーム数
+        self.learned = 0        # 色を覚え直した回数
+
+    def allocate(self, shape):
+        super().allocate(shape)
+        self.back = ensure_buffer(self.back, shape[:2])
+
+    def on_key(self, key, pipeline):
+        if key == ord('h'):             # 次のフレームで今のラベルから色を覚え直す
+            self.tracker.reset()
+            return True
+        if key == ord('g') and pipeline.backend.has_window and self.image is not None:
+            # ウィンドウ上でドラッグして範囲を選び，SpaceかEnterで確定する
+            # (表示している画像には枠が描かれているので，色は次のフレームの描画前の画像から覚える)
+            box = cv2.selectROI(MAIN_WINDOW, self.image.copy(), showCrosshair=False)
+            if box[2] > 0 and box[3] > 0:
+                self.selected = box
+            return True
+        return super().on_key(key, pipeline)
+
+    def process(self, ctx, pipeline):
+        image = ctx.image
+        self.image = image
+
+        # ウィンドウで選んだ範囲があれば，今のフレームのその範囲の色を覚える
+        if self.selected is not None:
+            box, self.selected = self.selected, None
+            self.tracker.learn(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), box)
+            self.blobs.reset()          # 次に見失った時は古い予測を使わずに画面全体から探す
+            self.learned += 1
+
+        # 追跡中なら前回の周りだけで逆投影とCamShift
+        box = self.tracker.update(image) if self.tracker.active() else None
+        self.tracking = box is not None
+        if self.tracking:
+            self.tracked += 1
+        else:
+            # 見失っていれば画面全体を2値化して，面積最大のラベルの色を覚え直す
+            super().process(ctx, pipeline)
+            self.thresholded += 1
+            blob = self.blobs.update(self.mask, ctx.timestamp)
+            if blob is not None:
+                self.tracker.learn(self.hsv, blob.box(), self.mask)
+                self.blobs.reset()      # CamShiftが見失った時は古い予測を使わずに画面全体から探す
+                self.learned += 1
+                box = blob.box()
+
+        self.box = box
+        if box is None:
+            self.controller.reset()     # 見失ったら積分・微分をやり直す
+            if pipeline.auto_mode == 1:
+                pipeline.send_rc(0, 0, 0, 0)    # 見失った時はその場で止まる(最後のrcを送り続けないように)
+            return
+        x, y, w, h = box
+        ctx.target = box
+
+        if pipeline.auto_mode == 1:
+            # 画面中心との差分(右にずれていたら正)から旋回量を計算する
+            error = (0.0, 0.0, 0.0, x + w/2 - image.shape[1]/2)
+            a, b, c, d = self.controller.update(error, ctx.timestamp)
+
+            print('dx=%f'%(error[3]) )
+            pipeline.send_rc( int(a), int(b), int(c), int(d) )
+
+    def overlay(self, ctx, pipeline):
+        if not self.tracking:
+            # 2値化したフレームは2値化ステージと同じ表示に，見つけたラベルの枠を描く
+            super().overlay(ctx, pipeline)
+            if self.box is not None:
+                x, y, w, h = self.box
+                cv2.rectangle(ctx.result, (x, y), (x+w, y+h), (255, 0, 255))
+            return
+
+        # 追跡したフレームはCamShiftの回転矩形と，探した範囲の逆投影を表示する
+        image = ctx.image
+        cv2.ellipse(image, self.tracker.rotated, (0, 255, 0), 2)
+        x0, y0, x1, y1 = self.tracker.roi
+        cv2.rectangle(image, (x0, y0), (x1-1, y1-1), (255, 0, 255))
+        ctx.show(MAIN_WINDOW, image)
+        self.back.fill(0)
+        self.back[y0:y1, x0:x1] = self.tracker.back
+        ctx.show(BINARY_WINDOW, self.back)
+
+    def teardown(self, pipeline):
+        print('camshift: tracked=%d thresholded=%d learned=%d' % (self.tracked, self.thresholded, self.learned))
+
+
+# Haar-like特徴の顔検出で，顔を画面中央・一定サイズに保つ顔追跡ステージ(step07)
+# roi=Trueなら，顔を見つけている間は予測位置の周りだけで顔検出する
+# track=Trueなら，顔検出の合間のフレームはテンプレートマッチングで顔の位置を更新し，
+# 相関が下がったら次のフレームで顔検出をやり直す
+# worker=Trueなら，顔検出は別プロセスで行い，ループは止めずに最新の検出結果を使う
+# profileは顔検出の設定('fast'/'balanced'/'accurate'．face.DETECTION_PROFILESを参照)
+# パイプラインに締め切りが設定されていれば，顔検出の間隔は負荷に合わせてintervalからmax_intervalまで変わる
+class FaceTrackingStage(Stage):
+    uses_auto_mode = True
+
+    def __init__(self, casc_path, interval=5, target_width=80, roi=False, track=False, worker=False,
+                 profile='accurate', controller=None, max_interval=15):
+        # カスケード分類器の初期化
+        self.casc_path = casc_path
+        self.profile = profile
+        self.detector = FaceDetector(casc_path, profile, target_width)
+        self.use_worker = worker    # 顔検出を別プロセスで行うか
+        self.worker = None          # 顔検出のワーカープロセス(setupで起動する)
+        self.detected_at = None     # 使っている検出結果のフレームの取得時刻
+        self.interval = interval            # 何フレームに1回顔検出するか
+        self.min_interval = interval        # 負荷が低い時の顔検出の間隔
+        self.max_interval = max_interval    # 負荷が高い時に広げる顔検出の間隔の上限
+        self.target_width = target_width    # 基準顔サイズ[px]
+        # 前後(基準顔サイズとの差)・上下・旋回(画面中心との差)のP制御．PIDにしたければcontrollerを渡す
+        self.controller = controller if controller is not None else PidController(
+            kp=(0, 0.4, 0.3, 0.3), deadband=(0, 10, 30, 20))
+        self.predictor = RoiPredictor(min_pad=24, max_misses=2) if roi else None    # 次の顔の位置とROIの予測
+        self.tracker = TemplateTracker() if track else None     # 顔検出の合間の追跡
+        self.redetect = False   # 次のフレームで顔検出をやり直すか
+        self.cnt_frame = 0      # フレーム枚数をカウントする変数
+        self.pre_faces = []     # 顔検出結果を格納する変数
+        self.gray = None        # グレイスケール画像の出力バッファ
+
+    def setup(self, pipeline):
+        if self.use_worker:
+            self.worker = FaceDetectWorker(self.casc_path, profile=self.profile, target_width=self.target_width)
+
+    def teardown(self, pipeline):
+        if self.worker is not None:
+            print('face worker: submitted=%d skipped=%d' % (self.worker.submitted, self.worker.skipped))
+            self.worker.close()
+            self.worker = None
+
+    def allocate(self, shape):
+        self.gray = ensure_buffer(self.gray, shape[:2])
+
+    # ワーカープロセスの最新の検出結果を取り込み，空いていれば今のフレームを渡す
+    # (ワーカーでの検出時間は，他の段階の処理時間と並べて見られるようにface_workerとして記録する)
+    def detect_async(self, ctx, pipeline):
+        result = self.worker.poll()
+        if result is not None:
+            seq, timestamp, faces, elapsed = result
+            pipeline.timer.record('face_worker', int(elapsed * 1e9))
+            self.pre_faces = np.array(faces).reshape(-1, 4)
+            self.detected_at = timestamp
+            # 検出したフレームは共有メモリに残っているので，そこからテンプレートを作る
+            if self.tracker is not None:
+                if len(faces) > 0:
+                    self.tracker.init(self.worker.frame(), faces[0])
+                    box = self.tracker.update(ctx.image)    # 検出したフレームから今のフレームまでの移動を追いかける
+                    if box is not None:
+                        self.pre_faces[0] = box
+                else:
+                    self.tracker.reset()
+        self.worker.submit(ctx.image, ctx.seq, ctx.timestamp)
+        return result is not None
+
+    # 顔検出して，元画像での(x,y,w,h)の配列を返す
+    def detect(self, image, t):
+        roi = None
+        if self.predictor is not None:
+            roi = self.predictor.roi(image.shape, t)
+        x0, y0, x1, y1 = roi if roi is not None else (0, 0, image.shape[1], image.shape[0])
+
+        # 顔検出のためにグレイスケール画像に変換，ヒストグラムの平坦化もかける(ROIの部分だけ)
+        gray = self.gray[y0:y1, x0:x1]
+        cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY, dst=gray)
+        cv2.equalizeHist(gray, dst=gray)
+
+        # 顔検出
+        faces = self.detector.detect(gray)
+        if len(faces) > 0:
+            faces = faces + (x0, y0, 0, 0)      # ROIの中の座標を元画像の座標に戻す
+
+        if self.predictor is not None:
+            if len(faces) == 0:
+                self.predictor.miss()           # 次はROIを広げて探す
+            else:
+                if self.predictor.locked():
+                    # 予測位置に一番近い顔を先頭にする
+                    px, py = self.predictor.predict(t)
+                    order = np.argsort(np.hypot(faces[:, 0] + faces[:, 2] / 2 - px, faces[:, 1] + faces[:, 3] / 2 - py))
+                    faces = faces[order]
+                self.predictor.hit(faces[0], t)
+        return faces
+
+    def process(self, ctx, pipeline):
+        image = ctx.image
+
+        if self.worker is not None:
+            # 顔検出は別プロセスに任せ，新しい結果が無いフレームは追跡で位置を更新する
+            if not self.detect_async(ctx, pipeline) and self.tracker is not None and self.tracker.active():
+                box = self.tracker.update(image)
+                self.pre_faces = [box] if box is not None else []
+        # intervalフレームに１回顔認識処理をする(追跡中に見失ったらすぐに)
+        elif self.cnt_frame >= self.interval or self.redetect:
+            self.redetect = False
+            # 顔検出して結果を格納
+            self.pre_faces = self.detect(image, ctx.timestamp)
+
+            # 検出した顔で追跡用のテンプレートを作り直す
+            if self.tracker is not None:
+                if len(self.pre_faces) > 0:
+                    self.tracker.init(image, self.pre_faces[0])
+                else:
+                    self.tracker.reset()
+
+            self.cnt_frame = 0   # フレーム枚数をリセット
+            # 処理が遅れていれば次の顔検出までの間隔を広げ，余裕があれば戻す
+            self.interval = pipeline.scheduler.adapt_interval(self.interval, self.min_interval, self.max_interval)
+        elif self.tracker is not None and self.tracker.active():
+            # 顔検出の合間は，テンプレートマッチングで1個めの顔の位置を更新する
+            box = self.tracker.update(image)
+            self.pre_faces = [box] if box is not None else []
+            self.redetect = box is None     # 相関が下がったら次のフレームで顔検出する
+
+        self.cnt_frame += 1  # フレームを+1枚
+
+        # 顔の検出結果が空なら，何もしない
+        if len(self.pre_faces) == 0:
+            self.controller.reset()     # 見失ったら積分・微分をやり直す
+            if pipeline.auto_mode == 1:
+                pipeline.send_rc(0, 0, 0, 0)    # 見失った時はその場で止まる(最後のrcを送り続けないように)
+            return
+
+        # １個めの顔のx,y,w,h,顔中心cx,cyを得る
+        x, y, w, h = self.pre_faces[0]
+        cx = int( x + w/2 )
+        cy = int( y + h/2 )
+        ctx.target = (x, y, w, h)
+
+        # 自動制御フラグが1の時だけ，Telloを動かす
+        if pipeline.auto_mode == 1:
+            # 目標との差分(前後:基準顔サイズとの差，上下:画面中心との差，旋回:画面中心との差)
+            error = (0.0, self.target_width - w, image.shape[0]/2 - cy, cx - image.shape[1]/2)
+            a, b, c, d = self.controller.update(error, ctx.timestamp)
+
+            print('dx=%f  dy=%f  dw=%f'%(error[3], error[2], error[1]) )  # printして偏差を確認できるように
+
+            # rcコマンドを送信
+            # ワーカーの検出結果をそのまま使う時は，顔の位置は検出したフレームの時点のものなので
+            # その取得時刻を渡す(追跡していれば今のフレームまで位置を進めてある)
+            frame_time = self.detected_at if self.worker is not None and self.tracker is None else None
+            pipeline.send_rc( int(a), int(b), int(c), int(d), frame_time )
+
+    def overlay(self, ctx, pipeline):
+        # 検出した顔に枠を書く
+        for (x, y, w, h) in self.pre_faces:
+            cv2.rectangle(ctx.image, (x, y), (x+w, y+h), (0, 255, 0), 2)
+
+
+# 下方カメラの画像で床のラインを追いかけるライントレースステージ(step06)
+# 画面全体ではなく，横長の帯(スキャンバンド)を何本か切り出してその中だけHSVで2値化し，
+# 帯ごとのラインの重心を直線で近似して，ラインのずれ(左右)と傾き(旋回)を制御する
+class LineTraceStage(HsvThresholdStage):
+    uses_auto_mode = True
+
+    def __init__(self, params_file=None, bands=5, band_height=12, min_pixels=20, speed=20, controller=None):
+        super().__init__(params_file)
+        self.num_bands = bands          # スキャンバンドの本数
+        self.band_height = band_height  # スキャンバンドの高さ[px]
+        self.min_pixels = min_pixels    # 帯の中のライン画素がこれ未満ならその帯にはラインが無いとする
+        self.speed = speed              # ラインが見えている時の前進速度(rcのb)
+        # 左右(ラインのずれ[px])と旋回(ラインの傾き[度])のP制御．PIDにしたければcontrollerを渡す
+        self.controller = controller if controller is not None else PidController(
+            kp=(0.3, 0, 0, 1.0), deadband=(5, 0, 0, 5))
+        self.bands = []         # 帯の(上端,下端)の行
+        self.points = []        # 帯ごとのラインの重心(x,y)
+        self.line = None        # 近似した直線 x = slope*y + intercept の(slope, intercept)
+        self.xs = None          # 重心計算用の列番号
+
+    def allocate(self, shape):
+        super().allocate(shape)
+        self.mask[:] = 0        # 帯の外は0のままにしておく(2値画像ウィンドウで帯だけが見える)
+        self.xs = np.arange(shape[1], dtype=np.float64)
+
+        # 帯を画面の上下に均等に並べる
+        height = shape[0]
+        step = height / self.num_bands
+        self.bands = []
+        for i in range(self.num_bands):
+            center = int(step * (i + 0.5))
+            top = max(center - self.band_height // 2, 0)
+            self.bands.append((top, min(top + self.band_height, height)))
+
+    def process(self, ctx, pipeline):
+        image = ctx.image
+        self.source = self.hsv
+        ctx.hsv = self.hsv
+        ctx.mask = self.mask
+
+        # 帯ごとにHSV変換と2値化をして，ラインの重心を求める
+        self.points = []
+        for top, bottom in self.bands:
+            hsv = self.hsv[top:bottom]
+            mask = self.mask[top:bottom]
+            cv2.cvtColor(image[top:bottom], cv2.COLOR_BGR2HSV, dst=hsv)
+            self.threshold_band(hsv, mask)
+            columns = np.count_nonzero(mask, axis=0)       # 列ごとのライン画素数
+            total = columns.sum()
+            if total >= self.min_pixels:
+                self.points.append((float(columns @ self.xs) / total, (top + bottom - 1) / 2.0))
+
+        # 2本以上の帯で見えたら直線 x = slope*y + intercept を当てはめる
+        if len(self.points) < 2:
+            self.line = None
+            self.controller.reset()     # 見失ったら積分・微分をやり直す
+            if pipeline.auto_mode == 1:
+                pipeline.send_rc(0, 0, 0, 0)    # ラインが見えない時はその場で止まる
+            return
+        points = np.array(self.points)
+        slope, intercept = np.polyfit(points[:, 1], points[:, 0], 1)
+        self.line = (slope, intercept)
+
+        # 画面中央の行でのラインのずれ(右にずれていたら正)と，
+        # 前方(画面の上)に向かって右に傾いていたら正になるラインの角度
+        height, width = image.shape[:2]
+        offset = slope * (height / 2) + intercept - width / 2
+        angle = np.degrees(np.arctan(-slope))
+        ctx.target = (offset, angle)
+
+        if pipeline.auto_mode == 1:
+            a, b, c, d = self.controller.update((offset, 0.0, 0.0, angle), ctx.timestamp)
+            pipeline.send_rc( int(a), int(self.speed), 0, int(d) )
+
+    # 帯の中だけを2値化する(Hueが0/179をまたぐ範囲も扱える)
+    def threshold_band(self, hsv, mask):
+        in_hsv_range(hsv, self.params.lower, self.params.upper, dst=mask)
+
+    def overlay(self, ctx, pipeline):
+        image = ctx.image
+        ctx.show(MAIN_WINDOW, image)
+        ctx.show(BINARY_WINDOW, self.mask)
+
+        # 帯の枠と，帯ごとのラインの重心を描く
+        for top, bottom in self.bands:
+            cv2.rectangle(image, (0, top), (image.shape[1]-1, bottom-1), (255, 0, 255))
+        for x, y in self.points:
+            cv2.circle(image, (int(x), int(y)), 4, (0, 255, 255), -1)
+
+        # 近似した直線と，ずれ・角度を描く
+        if self.line is not None:
+            slope, intercept = self.line
+            height = image.shape[0]
+            cv2.line(image, (int(intercept), 0), (int(slope * (height-1) + intercept), height-1), (0, 255, 0), 2)
+            offset, angle = ctx.target
+            cv2.putText(image, "offset=%d angle=%d"%(offset, angle), (5, 15), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0))
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# ループを段階ごとのスレッドに分けて並行に動かす実行モード
+#   取得スレッド : 新しいフレームを待って縮小・回転(前処理)する
+#   画像処理スレッド : ステージの画像処理と制御量の計算(rcの送信はRcSenderのスレッドが行う)
+#   メインスレッド : imshowとwaitKey，キー入力の処理(OpenCVのウィンドウはメインスレッドで扱う)
+# 段階の間は「一杯なら一番古いものを捨てる」長さの決まったキューでつなぐので，
+# 遅い段階があっても古いフレームが溜まらず，全体の速さは一番遅い段階の速さに近づく
+
+import collections              # 長さの決まったキューを作るため
+import queue                    # 空いているバッファのリストを2つのスレッドで使うため
+import threading                # 段階ごとのスレッドを使うため
+import time                     # 処理時間を測るため
+
+from .common import ensure_buffer
+
+
+# 一杯の時に入れると一番古いものを捨てるキュー(捨てた数はdroppedで数える)
+# on_dropを渡すと，捨てたものを引数にして呼ぶ(バッファを返すため)
+class DropOldestQueue:
+    def __init__(self, maxsize=1, on_drop=None):
+        self.items = collections.deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.on_drop = on_drop
+        self.dropped = 0
+
+    def put(self, item):
+        old = None
+        with self.cond:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+                old = self.items[0]
+            self.items.append(item)
+            self.cond.notify()
+        if old is not None and self.on_drop is not None:
+            self.on_drop(old)
+
+    # 最大timeout秒待って取り出す．何も来なければNoneを返す
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.items:
+                self.cond.wait(timeout)
+                if not self.items:
+                    return None
+            return self.items.popleft()
+
+
+# TelloPipelineの1フレーム分の処理を，取得・画像処理・表示の3つのスレッドに分けて実行するクラス
+class ThreadedLoop:
+    def __init__(self, pipeline, queue_size=1, pool_size=4):
+        self.pipeline = pipeline
+        # 取得 -> 画像処理(捨てたフレームのバッファは空きに戻す)
+        self.frames = DropOldestQueue(queue_size, on_drop=lambda item: self._release(item[0]))
+        self.views = DropOldestQueue(queue_size)    # 画像処理 -> 表示
+
+        # 前処理の結果を画像処理スレッドに渡すためのバッファの空きリスト
+        # 取得スレッドが空きから取り出して書き込み，画像処理スレッドが使い終わったら戻す
+        # (キューの中・画像処理中・書き込み中の分を用意する．空きが無ければそのフレームは捨てる)
+        self.free = queue.Queue()
+        for _ in range(max(pool_size, queue_size + 2)):
+            self.free.put(None)     # 中身は最初に使う時に確保する
+        self.pool_empty = 0         # 空きのバッファが無くて捨てたフレーム数
+
+        self.stop_event = threading.Event()
+        self.error = None           # スレッドで起きた例外(メインスレッドで投げ直す)
+        self.threads = []
+
+    def start(self):
+        for target, name in ((self._acquire, 'acquire'), (self._vision, 'vision')):
+            thread = threading.Thread(target=self._guard, args=(target,), name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    # スレッドで例外が起きたら覚えておいて，全スレッドを止める
+    def _guard(self, target):
+        try:
+            target()
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+
+    # 取得スレッド: 新しいフレームを待って前処理し，空いているバッファにコピーして渡す
+    def _acquire(self):
+        pipeline = self.pipeline
+        timer = pipeline.timer
+        while not self.stop_event.is_set():
+            start = time.perf_counter_ns()
+            frame = pipeline.source.wait_next(timeout=0.1)
+            if frame is None or pipeline.settling(frame.timestamp):
+                continue        # カメラの切替直後のフレームは処理しない
+            start = timer.lap('acquire', start)
+            if pipeline.recorder is not None:   # 記録するなら画像とステータスをキューに入れる
+                pipeline.recorder.write_frame(frame, pipeline.camera_dir)
+                pipeline.recorder.write_event('state', pipeline.tello.get_current_state())
+
+            try:
+                buffer = self.free.get_nowait()
+            except queue.Empty:
+                self.pool_empty += 1    # バッファが全部使われている(画像処理が追いついていない)
+                continue
+            small_image = pipeline.preprocess(frame.image)
+            buffer = ensure_buffer(buffer, small_image.shape)
+            buffer[...] = small_image
+            timer.lap('preprocess', start)
+            self.frames.put((buffer, frame.seq, frame.timestamp))
+
+    # 使い終わったバッファを空きに戻す
+    def _release(self, buffer):
+        self.free.put(buffer)
+
+    # 画像処理スレッド: ステージを実行して，表示するフレームなら描画した画像のコピーを渡す
+    def _vision(self):
+        pipeline = self.pipeline
+        timer = pipeline.timer
+        while not self.stop_event.is_set():
+            item = self.frames.get(timeout=0.1)
+            if item is None:
+                continue
+            if pipeline.scheduler.skip(item[2]):
+                self._release(item[0])  # 待っている間に古くなりすぎたフレームも処理しない
+                continue
+            ctx = pipeline.process_stages(*item)
+            views = {}
+            if pipeline.wants_overlay():
+                start = time.perf_counter_ns()
+                pipeline.render(ctx)
+                # ステージの出力バッファと元画像は次のフレームで上書きされるのでコピーして渡す
+                views = {name: view.copy() for name, view in ctx.views.items()}
+                timer.lap('overlay', start)
+            self._release(item[0])      # ここから先はバッファを使わない
+            self.views.put(views)
+            timer.frame_done()
+
+    # メインスレッドで1回分の表示とキー入力を行う．キーの値を返す
+    def poll(self, timeout=0.01):
+        if self.error is not None:
+            raise self.error
+        pipeline = self.pipeline
+        views = self.views.get(timeout)
+        start = time.perf_counter_ns()
+        if views is not None:
+            pipeline.backend.show(views)
+            start = pipeline.timer.lap('display', start)
+        key = pipeline.backend.poll_key()
+        pipeline.timer.lap('key', start)
+        return key
+
+    def stats(self):
+        return {'frames_dropped': self.frames.dropped, 'views_dropped': self.views.dropped,
+                'pool_empty': self.pool_empty}